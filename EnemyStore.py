@@ -0,0 +1,118 @@
+from array import array
+
+# numpy is optional, without it the columns are plain arrays and the batch damage is a loop.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Makes an attribute of an enemy live in its EnemyStore column once it has been added to a store.
+# Before that (and after it's removed) the value is kept in the enemy's attribute of the
+# same name with an underscore in front, which the enemy class has to provide.
+class StoredField(object):
+    def __init__(self, column, convert=int):
+        self.column = column
+        self.attribute = '_' + column
+        self.convert = convert
+
+    def __get__(self, enemy, owner):
+        if enemy is None:
+            return self
+        if enemy.store is None:
+            return getattr(enemy, self.attribute)
+        return self.convert(enemy.store.columns[self.column][enemy.slot])
+
+    def __set__(self, enemy, value):
+        if enemy.store is None:
+            setattr(enemy, self.attribute, value)
+        else:
+            enemy.store.columns[self.column][enemy.slot] = value
+
+# EnemyStore keeps the numbers that change during a fight in parallel columns, one slot per enemy,
+# so they can be worked on for many enemies at once. Each enemy object remembers its slot and
+# reads and writes its values through StoredFields, so scripted code doesn't need to know about the store.
+class EnemyStore(object):
+    COLUMNS = ['health', 'location', 'attack_power', 'is_attacking']
+
+    def __init__(self, capacity=64):
+        self.enemies = [] # slot -> enemy
+        self.columns = {}
+        for column in EnemyStore.COLUMNS:
+            self.columns[column] = self._new_column(capacity)
+
+    def _new_column(self, length):
+        if numpy is not None:
+            return numpy.zeros(length, dtype=numpy.int32)
+        return array('i', [0]) * length
+
+    # Doubles the columns until they have room for the given number of enemies.
+    def _grow(self, count):
+        length = len(self.columns['health'])
+        while length < count:
+            length *= 2
+        for column in EnemyStore.COLUMNS:
+            old = self.columns[column]
+            new = self._new_column(length)
+            new[:len(old)] = old
+            self.columns[column] = new
+
+    def add(self, enemy):
+        if len(self.enemies) == len(self.columns['health']):
+            self._grow(len(self.enemies) + 1)
+        slot = len(self.enemies)
+        for column in EnemyStore.COLUMNS:
+            self.columns[column][slot] = getattr(enemy, column)
+        self.enemies.append(enemy)
+        enemy.store = self
+        enemy.slot = slot
+        # The values live in the columns now, so the enemy doesn't need to keep its own:
+        for column in EnemyStore.COLUMNS:
+            setattr(enemy, '_' + column, None)
+
+    # Adds a lot of enemies at once, such as when a game is loaded, filling each column in one go.
+    def add_all(self, enemies):
+        first = len(self.enemies)
+        end = first + len(enemies)
+        if end > len(self.columns['health']):
+            self._grow(end)
+        for column in EnemyStore.COLUMNS:
+            attribute = '_' + column
+            self.columns[column][first:end] = array('i', [getattr(enemy, attribute) for enemy in enemies])
+        for slot, enemy in enumerate(enemies, first):
+            enemy.store = self
+            enemy.slot = slot
+            for column in EnemyStore.COLUMNS:
+                setattr(enemy, '_' + column, None)
+        self.enemies.extend(enemies)
+
+    # The last enemy is moved into the removed enemy's slot, so the columns never have gaps.
+    def remove(self, enemy):
+        slot = enemy.slot
+        values = [(column, getattr(enemy, column)) for column in EnemyStore.COLUMNS]
+        last = self.enemies.pop()
+        if last is not enemy:
+            for column in EnemyStore.COLUMNS:
+                self.columns[column][slot] = self.columns[column][last.slot]
+            self.enemies[slot] = last
+            last.slot = slot
+        enemy.store = None
+        enemy.slot = None
+        for column, value in values:
+            setattr(enemy, column, value)
+
+    # Takes each amount from the health of the enemy in the matching slot, a slot can appear more than once.
+    # Returns the enemies that are now dead.
+    def damage(self, slots, amounts):
+        health = self.columns['health']
+        if numpy is not None:
+            slots = numpy.asarray(slots, dtype=numpy.intp)
+            numpy.subtract.at(health, slots, numpy.asarray(amounts, dtype=numpy.int32))
+            dead = numpy.unique(slots[health[slots] <= 0])
+        else:
+            for slot, amount in zip(slots, amounts):
+                health[slot] -= amount
+            dead = sorted(set(slot for slot in slots if health[slot] <= 0))
+        return [self.enemies[slot] for slot in dead]
+
+    def __len__(self):
+        return len(self.enemies)
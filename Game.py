@@ -0,0 +1,1526 @@
+import os
+import re
+import json
+import logging
+import random
+import time
+from bisect import bisect
+from collections import OrderedDict
+from Map import Direction, NO_ROOM, load_world
+from Scheduler import Scheduler
+from MessageQueue import MessageQueue, TokenBucket
+from EnemyStore import EnemyStore, StoredField
+from Persistence import GameStore
+from Stats import Stats, timer
+
+robot_name = 'Smashing Robot'
+
+# Enemies to do:
+# Tenga Toppa Gurren Laggan!
+# Godzilla
+# Metal Gear RAY
+# Anubis
+
+# Returns the first element of a list if it exists, otherwise None
+def first(list):
+    return list[0] if list else None
+
+# Matches any direction, longest first so 'northeast' isn't matched as 'north'
+def direction_regex():
+    direction_strings = Direction.long_text + Direction.abbreviated_text
+    direction_strings.sort()
+    direction_strings.reverse()
+    return '('+'|'.join(direction_strings)+')'
+
+# Marks a method of Game as a player command, like errbot's botcmd.
+# verbs are the first words of the lines it handles, and pattern is the regex the line has to match.
+# A method can be decorated more than once.
+def playercmd(pattern, *verbs):
+    def decorate(function):
+        function.player_commands = getattr(function, 'player_commands', []) + [(pattern, verbs)]
+        return function
+    return decorate
+
+# Marks a command that does nothing new if a player says it again in the same tick, so the repeats are ignored.
+def coalesced(function):
+    function.coalesced = True
+    return function
+
+
+# An Action is a skill that has a certain amount of cooldown.
+# Actions are stored in Player and in Mech
+# Possibly rename to TimedAction?
+class Action(object):
+    __slots__ = ('name', 'active', 'duration', 'repeat', 'last_activation_time', 'event')
+
+    def __init__(self, name, duration, repeat):
+        self.name=name
+        self.active=False
+        self.duration=duration
+        self.repeat=repeat
+        self.last_activation_time=0
+        self.event=None # The ScheduledEvent for the next activation while active.
+
+    # This is called when the action is first executed, use this for instant commands like attack.
+    def on_activate(self, game):
+        pass
+
+    # This is used after a whole cycle - this should be used for commands that take a duration, like repair.
+    def on_complete(self, game):
+        pass
+
+    # Starts the action. It activates as soon as the cooldown from its last activation has passed.
+    def start(self, game):
+        if self.active:
+            return
+        self.active=True
+        activation_time = max(game.global_ticks+1, self.last_activation_time+self.duration)
+        self.event = game.scheduler.schedule(activation_time, self.activate, game)
+
+    def stop(self, game):
+        self.active=False
+        if self.event:
+            game.scheduler.cancel(self.event)
+            self.event=None
+
+    # Called by the scheduler when the action is due.
+    def activate(self, game):
+        self.event=None
+        self.last_activation_time = game.global_ticks
+        if self.repeat:
+            self.event = game.schedule(self.duration, self.activate, game)
+        else:
+            self.active=False
+        self.on_activate(game)
+
+class PlayerAttackAction(Action):
+    __slots__ = ('player', 'target')
+
+    def __init__(self, name, duration, player): # target = Entity
+        super(PlayerAttackAction, self).__init__(name, duration, True)
+        self.player = player
+        self.target = None
+
+    def on_activate(self, game):
+        # Another pilot may already have killed the target, and it may have been used again for an enemy somewhere else.
+        if not self.target or self.target not in game.entities or \
+                self.target.location != self.player.mech.position:
+            self.stop(game)
+            return
+        game.attack_target(self.player, self.target)
+
+    def on_user_left_room(self, game):
+        self.stop(game)
+
+class PlayerRepairAction(Action):
+    __slots__ = ('player', 'target')
+
+    def __init__(self, name, duration, player): # target = Entity
+        super(PlayerRepairAction, self).__init__(name, duration, False)
+        self.player = player
+        self.target = None
+
+    def on_activate(self, game):
+        # 'Name is starting to repair AdventureBot's head'
+        if not self.target:
+            self.stop(game)
+            return
+        game.attack_target(self.player, self.target)
+
+    def on_complete(self, game):
+        # Increase the robots level. Higher level people repair for more.
+        # If bot is full health then disabling repair.
+        pass
+
+    def on_user_left_room(self, game):
+        self.stop(game)
+
+# Walks a mech to a room, one room at a time.
+class TravelAction(Action):
+    __slots__ = ('mech', 'target')
+
+    def __init__(self, name, duration, mech): # target = room id
+        super(TravelAction, self).__init__(name, duration, True)
+        self.mech = mech
+        self.target = None
+
+    # The search stops when it reaches the target, so it gets cheaper the closer the mech gets.
+    def on_activate(self, game):
+        route = game.map.short_route(self.mech.position, self.target, Game.MAX_TRAVEL_DISTANCE)
+        if route is None or route[0] == Direction.NO_DIRECTION:
+            self.stop(game)
+            return
+        game.move_mech(self.mech, route[0])
+        if self.mech.position == self.target:
+            game.sendMessage(self.mech, 'You have arrived.')
+            self.stop(game)
+
+# Entity includes enemies and friendly NPCs (should the Mech be an entity?)
+class Entity(object):
+    __slots__ = ('id', 'health', 'name', 'location')
+    # What the players get for killing it.
+    xp = 0
+
+    def __init__(self, healthIn, nameIn, locationIn):
+        self.health = healthIn
+        self.name = nameIn
+        self.location = locationIn
+
+    # Entities sleep until something wakes them with game.wake_entity (usually in
+    # on_user_entered_room or on_attacked). Only awake entities are updated, once per tick.
+    # Anything timed is better scheduled with game.schedule so it only costs something when it happens.
+    def update(self, game): # Takes the instance of Game so that it can modify the world.
+        pass
+
+    # Called when the entity is added to the awake set
+    def on_wake(self, game):
+        pass
+
+    # Called when the entity is taken out of the awake set
+    def on_sleep(self, game):
+        pass
+
+    # Called when the entity is taken out of the world, after it has been put to sleep.
+    def on_removed(self, game):
+        pass
+
+    # Called once this tick's attacks have been taken off the entity's health. died says whether they killed it,
+    # in which case it's removed from the world afterwards.
+    def on_damaged(self, game, power, died):
+        pass
+
+    # Called when a mech enters the room
+    def on_user_entered_room(self, game, mech):
+        pass
+
+    # Called when a mech leaves the room
+    def on_user_left_room(self, game, mech):
+        pass
+
+# Keeps every entity in the world by id, along with a per-room index of them, so that finding an
+# entity by id, finding the entities in a room and removing a dead entity are all O(1).
+# Entities must have their id before they're added. Ids are handed out in order, so going
+# through the entities by id goes through them in the order they arrived.
+# OrderedDicts are used as ordered sets so rooms list their entities in the order they arrived.
+# Most rooms have one entity at most, so a room with a single entity holds it directly
+# rather than in an OrderedDict, which would cost more than the entity itself.
+class EntityIndex(object):
+    def __init__(self, entities=()):
+        self.by_id = {} # entity id -> Entity
+        self.rooms = {} # room id -> Entity or OrderedDict(Entity -> None)
+        for entity in entities:
+            self.add(entity)
+
+    def add(self, entity):
+        self.by_id[entity.id] = entity
+        self._add_to_room(entity)
+
+    # Adds a lot of entities at once, such as when a game is loaded, making each room's occupants in one go.
+    def add_all(self, entities):
+        arrivals = {} # room id -> [Entity, ...]
+        for entity in entities:
+            self.by_id[entity.id] = entity
+            arrivals.setdefault(entity.location, []).append(entity)
+        for room_id, room_entities in arrivals.iteritems():
+            if len(room_entities) == 1 and room_id not in self.rooms:
+                self.rooms[room_id] = room_entities[0]
+            else:
+                self.rooms[room_id] = OrderedDict.fromkeys(self.in_room(room_id) + room_entities)
+
+    def remove(self, entity):
+        del self.by_id[entity.id]
+        self._remove_from_room(entity)
+
+    # Returns the entity with the given id, or None if there isn't one.
+    def get(self, entity_id):
+        return self.by_id.get(entity_id)
+
+    # Changes the location of an entity, keeping the room index up to date.
+    def move(self, entity, location):
+        self._remove_from_room(entity)
+        entity.location = location
+        self._add_to_room(entity)
+
+    def in_room(self, room_id):
+        occupants = self.rooms.get(room_id)
+        if occupants is None:
+            return []
+        if isinstance(occupants, OrderedDict):
+            return list(occupants)
+        return [occupants]
+
+    def _add_to_room(self, entity):
+        occupants = self.rooms.get(entity.location)
+        if occupants is None:
+            self.rooms[entity.location] = entity
+        elif isinstance(occupants, OrderedDict):
+            occupants[entity] = None
+        else:
+            self.rooms[entity.location] = OrderedDict([(occupants, None), (entity, None)])
+
+    def _remove_from_room(self, entity):
+        occupants = self.rooms[entity.location]
+        # Don't keep empty rooms around on large maps:
+        if occupants is entity:
+            del self.rooms[entity.location]
+            return
+        del occupants[entity]
+        if len(occupants) == 1:
+            self.rooms[entity.location] = next(iter(occupants))
+
+    # Iterates over a copy, in the order the entities arrived, so entities can be removed while updating.
+    def __iter__(self):
+        return iter([self.by_id[entity_id] for entity_id in sorted(self.by_id)])
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, entity):
+        return self.by_id.get(entity.id) is entity
+
+def seconds_to_updates(seconds):
+    return seconds * 10
+
+# The simplest type of enemy.
+# It's either passive or aggro and once it starts attacking it doesn't stop.
+# It contains an array of different attacks.
+class SimpleEnemy(Entity):
+    # Everything that's the same for every enemy of a kind is in its EnemyType, so an enemy only
+    # has to hold its own state. Once the enemy is in a game its StoredFields are kept in the game's EnemyStore.
+    __slots__ = ('enemy_type', 'store', 'slot', '_health', '_location', '_attack_power', '_is_attacking',
+                 'attack_counter', 'attack_started', 'attack_event', 'pursuit_event', 'spawn_table')
+    health = StoredField('health')
+    location = StoredField('location')
+    attack_power = StoredField('attack_power')
+    is_attacking = StoredField('is_attacking', bool)
+
+    def __init__(self, enemy_type, locationIn):
+        # Entity.__init__ isn't used because the name comes from the type.
+        self.store = None
+        self.slot = None
+        self.reset(enemy_type, locationIn)
+
+    # Makes the enemy as good as new, so a dead one can be used again rather than making another.
+    def reset(self, enemy_type, locationIn):
+        self.enemy_type = enemy_type
+        self.health = enemy_type.health
+        self.location = locationIn
+        self.attack_power = enemy_type.attack_power
+        self.is_attacking = False
+
+        self.attack_counter = 0 # Ticks of cool-down already waited, kept while the user is in another room.
+        self.attack_started = 0
+        self.attack_event = None
+        self.pursuit_event = None
+        self.spawn_table = None # The SpawnTable it came from, if any.
+
+    @property
+    def name(self):
+        return self.enemy_type.name
+
+    @property
+    def detailed_look(self):
+        return self.enemy_type.detailed_look
+
+    @property
+    def xp(self):
+        return self.enemy_type.xp
+
+    def on_damaged(self, game, power, died):
+        if died:
+            game.sendMessageNear(self.location, game.random.choice(self.enemy_type.on_death_strings))
+            return
+        game.sendMessageNear(self.location, game.random.choice(self.enemy_type.on_damage_strings)+' and loses '+str(power)+' health (' + str(self.health)+' remaining).')
+        self.is_attacking = True
+        game.wake_entity(self)
+
+    # Called when a mech enters the room:
+    def on_user_entered_room(self, game, mech):
+        # Show the image of this enemy:
+        urlname = self.name.replace('-', '').lower()
+        game.sendMessage(mech, '<html><body><img src="http://secondreality.co.uk/adventurebot/'+urlname+'.jpg"/></body></html>')
+        game.sendMessage(mech, game.random.choice(self.enemy_type.on_enter_strings))
+        if self.pursuit_event:
+            game.scheduler.cancel(self.pursuit_event)
+            self.pursuit_event = None
+        if self.is_attacking:
+            game.wake_entity(self)
+
+    # Called when a mech leaves the room
+    def on_user_left_room(self, game, mech):
+        if self.is_attacking and self.enemy_type.pursues and not self.pursuit_event and not game.mechs_in_room(self.location):
+            self.pursuit_event = game.schedule(seconds_to_updates(self.enemy_type.pursuit_speed), self.pursue, game, mech)
+
+    # Moves a room closer to the mech, and starts attacking again if it gets there.
+    # The mech moves all the time, so the search only goes as far as pursuit_range rather than building a path table.
+    def pursue(self, game, mech):
+        self.pursuit_event = None
+        route = game.map.short_route(self.location, mech.position, self.enemy_type.pursuit_range)
+        if route is None:
+            return
+        direction, distance = route
+        if distance:
+            game.move_entity(self, game.map.get_connection(self.location, direction))
+        if self.location == mech.position:
+            game.sendMessage(mech, 'The '+self.name+' follows you.')
+            game.wake_entity(self)
+        else:
+            self.pursuit_event = game.schedule(seconds_to_updates(self.enemy_type.pursuit_speed), self.pursue, game, mech)
+
+    def on_wake(self, game):
+        if self.is_attacking:
+            self.start_attack_timer(game)
+
+    def on_sleep(self, game):
+        self.stop_attack_timer(game)
+
+    def on_removed(self, game):
+        if self.pursuit_event:
+            game.scheduler.cancel(self.pursuit_event)
+            self.pursuit_event = None
+
+    # Schedules the next attack, carrying on from any cool-down already waited.
+    def start_attack_timer(self, game):
+        if self.attack_event:
+            return
+        self.attack_started = game.global_ticks - self.attack_counter
+        delay = seconds_to_updates(self.enemy_type.attack_cooldown) - self.attack_counter
+        self.attack_event = game.schedule(delay, self.attack, game)
+
+    def stop_attack_timer(self, game):
+        if not self.attack_event:
+            return
+        game.scheduler.cancel(self.attack_event)
+        self.attack_event = None
+        self.attack_counter = game.global_ticks - self.attack_started
+
+    # Attacks the first piloted mech in the room. With nobody left to fight the enemy goes to sleep,
+    # still attacking, so it starts again when a mech comes in or gets a pilot.
+    def attack(self, game):
+        self.attack_event = None
+        self.attack_counter = 0
+        mechs = game.piloted_mechs_in_room(self.location)
+        if not mechs:
+            game.sleep_entity(self)
+            return
+        game.on_mech_damaged(mechs[0], game.random.choice(self.enemy_type.on_attack_text), self.attack_power)
+        self.start_attack_timer(game)
+
+class Player(object):
+    __slots__ = ('name', 'level', 'xp', 'actions', 'attack_action', 'mech', 'last_command')
+
+    ranks = ['noob', 'grunt', 'veteran', 'commander', 'master chief']
+
+    def __init__(self, nameIn):
+        self.name = nameIn
+        self.level = 1
+        self.xp = 0
+        self.actions = []
+        self.attack_action = PlayerAttackAction('attack', seconds_to_updates(3), self)
+        self.mech = None # The Mech they're piloting.
+        self.last_command = None # (tick, text) of their last coalesced command.
+
+    def formal_identifier(self):
+        return self.title()+' '+self.name
+
+    def title(self):
+        if self.level < len(Player.ranks):
+            return Player.ranks[self.level]
+        else:
+            return 'big boss'
+
+    def xp_required_for_level(self, level):
+        return 100
+
+    # If the player levels up, returns True
+    def gain_xp(self, xpIn):
+        current_xp_required_for_level = self.xp_required_for_level(self.level)
+        self.xp+=xpIn
+        if self.xp > current_xp_required_for_level:
+            self.level+=1
+            self.xp = 0
+            return True
+        return False
+
+    def update(self, game):
+        pass
+
+    def on_user_left_room(self, game):
+        self.attack_action.on_user_left_room(game)
+
+class BodyPart(object):
+    __slots__ = ('pilots', 'health', 'name')
+
+    def __init__(self, nameIn):
+        self.pilots = [] # An array of Players.
+        self.health = 100
+        self.name = nameIn
+
+# A robot walking around the world, piloted by some of the players. Each mech has its own outbox,
+# and what's said to it only goes to its pilots.
+class Mech:
+    LEGS = 0
+    ARMS = 1
+    HEAD = 2
+
+    def __init__(self, mech_id=0, position=0, outbox=None):
+        self.id = mech_id
+        self.name = robot_name if mech_id == 0 else robot_name + ' ' + str(mech_id+1)
+        self.position = position
+        self.outbox = outbox
+        self.last_look = None # (tick, room id) the pilots were last shown the room they're in.
+        self.health = 100
+        self.legs = BodyPart("legs")
+        self.arms = BodyPart("arms")
+        self.head = BodyPart("head")
+        self.parts = [self.legs, self.arms, self.head]
+        self.travel_action = TravelAction('travel', seconds_to_updates(2), self)
+
+    def pilots(self):
+        return self.legs.pilots + self.arms.pilots + self.head.pilots
+
+    def add_pilot(self, bodypart, player):
+        if not player in self.parts[bodypart].pilots:
+            self.parts[bodypart].pilots.append(player)
+
+    def remove_pilot(self, player):
+        for part in self.parts:
+            if player in part.pilots:
+                part.pilots.remove(player)
+
+    # Returns the index of the body part the player is piloting, or None.
+    def bodypart_of(self, player):
+        for bodypart, part in enumerate(self.parts):
+            if player in part.pilots:
+                return bodypart
+        return None
+
+    # returns the least populous body part, giving preference to the feet
+    def leastPopulousMechBodyPart(self):
+        popularity = [] # (int[section]->)
+        # Returns the index of the least populous mech section:
+
+        popularity.append(len(self.legs.pilots))
+        popularity.append(len(self.arms.pilots))
+        popularity.append(len(self.head.pilots))
+
+        # now find the index of the greatest value:
+        return popularity.index(min(popularity))
+
+# What we know about a player's time in the game, kept by the PlayerRegistry.
+class PlayerSession(object):
+    __slots__ = ('player', 'joined_tick', 'last_seen_tick')
+
+    def __init__(self, player, tick):
+        self.player = player
+        self.joined_tick = tick
+        self.last_seen_tick = tick
+
+# Looks players up by name in O(1).
+# Sessions are kept in the order they were last seen, so the ones that have expired are always at the front.
+class PlayerRegistry(object):
+    def __init__(self):
+        self.sessions = OrderedDict() # name -> PlayerSession
+
+    def join(self, player, tick):
+        self.sessions[player.name] = PlayerSession(player, tick)
+
+    # Returns the Player that left, or None if there was no player with that name.
+    def leave(self, name):
+        session = self.sessions.pop(name, None)
+        return session.player if session else None
+
+    # Changing name counts as being seen on the given tick, as the session moves to the end of the order.
+    def rename(self, old_name, new_name, tick):
+        session = self.sessions.pop(old_name)
+        session.player.name = new_name
+        session.last_seen_tick = tick
+        self.sessions[new_name] = session
+
+    def get(self, name):
+        session = self.sessions.get(name)
+        return session.player if session else None
+
+    def get_session(self, name):
+        return self.sessions.get(name)
+
+    # Records that a player did something on the given tick.
+    def seen(self, name, tick):
+        session = self.sessions.pop(name)
+        session.last_seen_tick = tick
+        self.sessions[name] = session
+
+    # Returns the names of players not seen since before the given tick.
+    def expired(self, tick):
+        names = []
+        for name, session in self.sessions.items():
+            if session.last_seen_tick >= tick:
+                break
+            names.append(name)
+        return names
+
+    # Iterates over a copy so players can leave while we go through them.
+    def __iter__(self):
+        return iter([session.player for session in self.sessions.values()])
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, name):
+        return name in self.sessions
+
+# What a player is told when they look around a room, kept so it isn't built again for every look.
+# exits and occupants are None until they're needed, and go back to None when the
+# connections or the entities in the room change.
+class RoomView(object):
+    __slots__ = ('description', 'exits', 'occupants')
+
+    def __init__(self, description):
+        self.description = description
+        self.exits = None
+        self.occupants = None
+
+# Strings that appear more than once in the catalogue are only kept once.
+def share_string(shared_strings, text):
+    return shared_strings.setdefault(text, text)
+
+# Everything about a kind of enemy that doesn't change from one enemy to the next.
+# There's one of these for each kind, shared by all the enemies of that kind.
+class EnemyType(object):
+    __slots__ = ('name', 'health', 'attack_power', 'attack_cooldown', 'xp', 'detailed_look', 'on_player_kill',
+                 'on_attack_text', 'on_death_strings', 'on_enter_strings', 'on_damage_strings',
+                 'pursues', 'pursuit_range', 'pursuit_speed')
+
+    def __init__(self, name, data, shared_strings):
+        # {robot} in any of the text is replaced with the name of the robot.
+        def text(value):
+            return share_string(shared_strings, value.replace('{robot}', robot_name))
+
+        self.name = text(name)
+        self.health = data['health']
+        self.attack_power = data.get('attack_power', 10)
+        self.attack_cooldown = data.get('attack_cooldown', 5) # The attack cool-down in seconds.
+        self.xp = data.get('xp', 0)
+        self.detailed_look = text(data['detailed_look'])
+        self.on_player_kill = text('A laughing noise comes from the '+name+'.')
+        self.on_attack_text = tuple(text(line) for line in data['on_attack_text'])
+        self.on_death_strings = tuple(text(line) for line in data['on_death_strings'])
+        self.on_enter_strings = tuple(text(line) for line in data['on_enter_strings'])
+        self.on_damage_strings = tuple(text(line) for line in data['on_damage_strings'])
+
+        # Enemies that pursue follow the mech when it leaves while they're attacking,
+        # as long as it's no more than pursuit_range rooms away.
+        self.pursues = data.get('pursues', False)
+        self.pursuit_range = data.get('pursuit_range', 5)
+        self.pursuit_speed = data.get('pursuit_speed', 3) # Seconds to move a room.
+
+# Reads a catalogue of enemy types from a json file of name -> properties.
+def load_enemy_types(path):
+    with open(path) as catalogue_file:
+        catalogue = json.load(catalogue_file)
+    shared_strings = {}
+    enemy_types = {}
+    for name in catalogue:
+        enemy_types[name] = EnemyType(name, catalogue[name], shared_strings)
+    return enemy_types
+
+# Where enemies live: the rooms they appear in, which types of enemy in what proportions,
+# how many can be alive at once, and how long after one dies another takes its place.
+# Like EnemyTypes these are shared by every game, how many enemies each has alive is kept by the game.
+class SpawnTable(object):
+    __slots__ = ('name', 'rooms', 'first_room', 'last_room', 'enemy_types', 'weights', 'cap', 'respawn_ticks')
+
+    # Tries this many rooms for one without a mech in it before giving up until later.
+    ROOM_ATTEMPTS = 4
+
+    def __init__(self, data, enemy_types):
+        self.name = data['name']
+        # Either a list of rooms, or a region of rooms numbered from first to last:
+        self.rooms = tuple(data.get('rooms', ()))
+        self.first_room, self.last_room = data.get('region', (None, None))
+        self.enemy_types = []
+        self.weights = [] # Running totals of the weights, for bisecting.
+        total = 0
+        for type_name, weight in sorted(data['enemies'].items()):
+            total += weight
+            self.enemy_types.append(enemy_types[type_name])
+            self.weights.append(total)
+        self.cap = data.get('cap', 1)
+        self.respawn_ticks = seconds_to_updates(data.get('respawn', 60))
+
+    def contains(self, room_id):
+        if self.rooms:
+            return room_id in self.rooms
+        return self.first_room <= room_id <= self.last_room
+
+    def choose_room(self, rng):
+        if len(self.rooms) == 1:
+            return self.rooms[0]
+        if self.rooms:
+            return rng.choice(self.rooms)
+        return rng.randint(self.first_room, self.last_room)
+
+    def choose_type(self, rng):
+        if len(self.enemy_types) == 1:
+            return self.enemy_types[0]
+        return self.enemy_types[bisect(self.weights, rng.random() * self.weights[-1])]
+
+# Reads the spawn tables from a json list of tables.
+def load_spawn_tables(path, enemy_types):
+    with open(path) as spawns_file:
+        return [SpawnTable(data, enemy_types) for data in json.load(spawns_file)]
+
+# Game holds one world and everyone playing in it. There's a Game for each chat room,
+# it only talks to the room through the send function it is given, which takes the text of a message.
+class Game(object):
+    # How many messages a second we send to the room, and how many we can send at once.
+    MESSAGE_RATE = 1
+    MESSAGE_BURST = 5
+    # Players that haven't said anything for this long are removed from the game.
+    SESSION_TIMEOUT = seconds_to_updates(30*60)
+    SESSION_CHECK_INTERVAL = seconds_to_updates(60)
+    # How often a game with a save path writes a snapshot of itself.
+    SNAPSHOT_INTERVAL = seconds_to_updates(5*60)
+    SNAPSHOT_VERSION = 3
+    # How many rooms we keep RoomViews for.
+    ROOM_VIEW_CACHE_SIZE = 1024
+    # The furthest a mech can be sent with 'go to'. The way is searched for from the mech on the game loop,
+    # so this keeps the search to the rooms nearby however big the world is.
+    MAX_TRAVEL_DISTANCE = 50
+
+    WORLD_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worlds', 'default.txt')
+    ENEMY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worlds', 'enemies.json')
+    SPAWN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worlds', 'spawns.json')
+    # The enemy types and spawn tables are loaded the first time a game starts, and shared by every game.
+    enemy_types = None
+    spawn_tables = None
+    # How many dead enemies a game keeps to use again for the ones that respawn.
+    ENEMY_POOL_SIZE = 256
+
+    # How much health one pilot's stomp takes off.
+    ATTACK_POWER = 20
+    # How many mechs a new game has. With more than one, what's said to a mech is sent privately to its pilots.
+    MECH_COUNT = 1
+
+    active_entities = None
+
+    # Gives a mech's pilots the xp for each kill in turn, with one message each for those that went up a level.
+    def gain_xp(self, mech, kills_xp):
+        for player in mech.pilots():
+            levelled_up = False
+            for xp in kills_xp:
+                if player.gain_xp(xp):
+                    levelled_up = True
+            if levelled_up:
+                self.sendMessage(mech, player.formal_identifier()+' is now level '+str(player.level)+'.')
+            self.record_player(player)
+
+    # If save_path is given the game is saved there as it's played, and carries on from
+    # where it was if there's already a save. world_map can be given instead of world_file
+    # to use a Map that's already been built. clock is used for rate limiting messages.
+    # Timings go into stats, which can be shared between games. enemies is what a new game starts with,
+    # as (room id, enemy type name) pairs, instead of filling up the spawn tables. Those enemies don't
+    # respawn, and the game has no spawn tables unless they're given as spawn_tables.
+    # send is called with the text of a message, and a list of player names if it's only for them.
+    # Everything left to chance in the game comes from its own random number generator, seeded with seed
+    # if it's given, so a game can be replayed without touching the random module's state.
+    def __init__(self, send, world_file=None, save_path=None, world_map=None, clock=time.time, stats=None,
+                 enemies=None, mech_count=None, spawn_tables=None, seed=None):
+        # We update our world 10 times a second.
+        self.global_ticks = 0
+        self.scheduler = Scheduler()
+        self.random = random.Random(seed)
+        self.map = world_map or load_world(world_file or Game.WORLD_FILE)
+        self.room_views = OrderedDict() # room id -> RoomView, least recently used first.
+        self.map.connection_listeners.append(self.forget_exits)
+        self.send = send
+        self.stats = stats or Stats()
+        # The mechs all start in the world's starting room. Everything said to a mech in a tick or
+        # a command goes out as one message. The mechs share one rate limit, which counts each
+        # private message to a pilot, so the game sends no more than MESSAGE_RATE messages a second however
+        # many mechs and pilots it has.
+        self.mechs = []
+        self.mechs_by_room = {} # room id -> [Mech, ...], only for rooms with a mech in them.
+        self.send_limiter = TokenBucket(Game.MESSAGE_RATE, Game.MESSAGE_BURST, clock)
+        self.next_flush_mech = 0 # The mech whose outbox is sent first on the next flush.
+        for mech_id in range(mech_count or Game.MECH_COUNT):
+            mech = Mech(mech_id, self.map.position)
+            mech.outbox = MessageQueue(lambda text, mech=mech: self.send_to_mech(mech, text),
+                                       Game.MESSAGE_RATE, Game.MESSAGE_BURST, clock=clock, limiter=self.send_limiter,
+                                       cost=lambda mech=mech: self.sends_per_message(mech))
+            self.mechs.append(mech)
+            self.mechs_by_room.setdefault(mech.position, []).append(mech)
+        self.entities = EntityIndex()
+        self.next_entity_id = 0
+        self.enemy_store = EnemyStore()
+        self.awake_entities = OrderedDict() # Entity -> None, the entities updated each tick.
+        self.pending_attacks = OrderedDict() # Entity -> [Player, ...], the attacks made this tick.
+        self.players = PlayerRegistry()
+        self.game_store = None
+        # Events that come round again and again to look after the game, which don't stop it being idle:
+        self.evict_event = None
+        self.snapshot_event = None
+        self.initial_enemies = enemies
+        self.enemy_pool = [] # Dead SimpleEnemies waiting to be used again.
+        if Game.enemy_types is None:
+            Game.enemy_types = load_enemy_types(Game.ENEMY_FILE)
+        if spawn_tables is None and enemies is None:
+            if Game.spawn_tables is None:
+                Game.spawn_tables = load_spawn_tables(Game.SPAWN_FILE, Game.enemy_types)
+            spawn_tables = Game.spawn_tables
+        self.spawn_tables = spawn_tables or []
+        self.spawn_population = dict((table, 0) for table in self.spawn_tables) # SpawnTable -> enemies alive
+        self.pending_respawns = dict((table, 0) for table in self.spawn_tables) # SpawnTable -> respawns scheduled
+        if save_path:
+            self.load_game(save_path)
+        else:
+            self.add_initial_entities()
+        self.evict_event = self.schedule(Game.SESSION_CHECK_INTERVAL, self.evict_expired_players)
+
+        # Hook up our commands:
+        self.commands = {} # verb -> [(compiled pattern, handler)]
+        for cls in reversed(type(self).__mro__):
+            for name, function in vars(cls).items():
+                for pattern, verbs in getattr(function, 'player_commands', []):
+                    compiled = re.compile(pattern)
+                    for verb in verbs:
+                        self.commands.setdefault(verb, []).append((compiled, getattr(self, name)))
+
+    def get_entities_in_room(self, room_id):
+        return self.entities.in_room(room_id)
+
+    def mechs_in_room(self, room_id):
+        return self.mechs_by_room.get(room_id, [])
+
+    def piloted_mechs_in_room(self, room_id):
+        return [mech for mech in self.mechs_by_room.get(room_id, ()) if mech.pilots()]
+
+    # Enemies only fight mechs with pilots in them, so these are called when a room's first
+    # piloted mech gets its first pilot, or its last one loses theirs.
+    def wake_attackers(self, room_id):
+        for entity in self.get_entities_in_room(room_id):
+            if isinstance(entity, SimpleEnemy) and entity.is_attacking:
+                self.wake_entity(entity)
+
+    def sleep_attackers(self, room_id):
+        for entity in self.get_entities_in_room(room_id):
+            if isinstance(entity, SimpleEnemy):
+                self.sleep_entity(entity)
+
+    # The mechs that hear about things happening in a room: those in it or next door to it.
+    # This only looks at the room and its neighbours, so it costs the same however many mechs there are.
+    def mechs_near(self, room_id):
+        mechs = list(self.mechs_by_room.get(room_id, ()))
+        for direction in range(Direction.COUNT):
+            neighbour = self.map.get_connection(room_id, direction)
+            if neighbour != NO_ROOM and neighbour in self.mechs_by_room:
+                mechs.extend(self.mechs_by_room[neighbour])
+        return mechs
+
+    # Mechs should move through here rather than setting their position directly.
+    def place_mech(self, mech, room_id):
+        mechs = self.mechs_by_room[mech.position]
+        mechs.remove(mech)
+        if not mechs:
+            del self.mechs_by_room[mech.position]
+        mech.position = room_id
+        self.mechs_by_room.setdefault(room_id, []).append(mech)
+
+    # Fills up the spawn tables, or adds the enemies the game was asked to start with.
+    def add_initial_entities(self):
+        if self.initial_enemies is None:
+            for table in self.spawn_tables:
+                while self.spawn_population[table] < table.cap:
+                    if not self.spawn_enemy(table):
+                        self.schedule_respawn(table)
+                        break
+        else:
+            for room_id, type_name in self.initial_enemies:
+                self.add_entity(self.new_enemy(Game.enemy_types[type_name], room_id))
+        self.initial_enemies = None
+
+    # Makes a SimpleEnemy, using a dead one from the pool if there is one.
+    def new_enemy(self, enemy_type, location):
+        if self.enemy_pool:
+            enemy = self.enemy_pool.pop()
+            enemy.reset(enemy_type, location)
+            return enemy
+        return SimpleEnemy(enemy_type, location)
+
+    # Adds an enemy from a spawn table in one of its rooms without a mech in it.
+    # Returns the enemy, or None if every room tried had a mech in it.
+    def spawn_enemy(self, table):
+        for attempt in range(SpawnTable.ROOM_ATTEMPTS):
+            room_id = table.choose_room(self.random)
+            if not self.mechs_in_room(room_id):
+                break
+        else:
+            return None
+        enemy = self.new_enemy(table.choose_type(self.random), room_id)
+        enemy.spawn_table = table
+        self.add_entity(enemy)
+        return enemy
+
+    def schedule_respawn(self, table):
+        self.pending_respawns[table] += 1
+        self.schedule(table.respawn_ticks, self.respawn, table)
+
+    def respawn(self, table):
+        self.pending_respawns[table] -= 1
+        if self.spawn_population[table] < table.cap and not self.spawn_enemy(table):
+            # There was a mech in the way, try again later.
+            self.schedule_respawn(table)
+
+    # Schedules respawns for any enemies the spawn tables are short of that aren't already on their way,
+    # such as those that were waiting to respawn when the game was last saved.
+    def schedule_missing_respawns(self):
+        for table in self.spawn_tables:
+            for number in range(table.cap - self.spawn_population[table] - self.pending_respawns[table]):
+                self.schedule_respawn(table)
+
+    # The spawn table an enemy from a save made before spawn tables were saved belongs to.
+    def find_spawn_table(self, enemy_type, location):
+        for table in self.spawn_tables:
+            if enemy_type in table.enemy_types and table.contains(location):
+                return table
+        return None
+
+    def get_spawn_table(self, name):
+        for table in self.spawn_tables:
+            if table.name == name:
+                return table
+        return None
+
+    # Entities are given the next free id unless one is passed in.
+    def add_entity(self, entity, entity_id=None):
+        if entity_id is None:
+            entity_id = self.next_entity_id
+        entity.id = entity_id
+        self.next_entity_id = max(self.next_entity_id, entity_id + 1)
+        if isinstance(entity, SimpleEnemy):
+            self.enemy_store.add(entity)
+            if entity.spawn_table:
+                self.spawn_population[entity.spawn_table] += 1
+        self.entities.add(entity)
+        self.forget_occupants(entity.location)
+        self.record_enemy(entity)
+
+    # Enemies from a spawn table have another take their place later, and dead SimpleEnemies
+    # go back in the pool to be used again, so nothing else should keep hold of them.
+    def remove_entity(self, entity):
+        self.entities.remove(entity)
+        self.forget_occupants(entity.location)
+        self.sleep_entity(entity)
+        entity.on_removed(self)
+        self.record('removed', entity.id)
+        if isinstance(entity, SimpleEnemy):
+            self.enemy_store.remove(entity)
+            if entity.spawn_table:
+                self.spawn_population[entity.spawn_table] -= 1
+                self.schedule_respawn(entity.spawn_table)
+                entity.spawn_table = None
+            if len(self.enemy_pool) < Game.ENEMY_POOL_SIZE:
+                self.enemy_pool.append(entity)
+
+    # Entities should move through here rather than setting their location directly.
+    def move_entity(self, entity, room_id):
+        self.forget_occupants(entity.location)
+        self.entities.move(entity, room_id)
+        self.forget_occupants(room_id)
+        self.record_enemy(entity)
+
+    # Adds an entity to the set updated every tick. Waking an awake entity does nothing.
+    def wake_entity(self, entity):
+        if entity not in self.awake_entities:
+            self.awake_entities[entity] = None
+            entity.on_wake(self)
+
+    def sleep_entity(self, entity):
+        if entity in self.awake_entities:
+            del self.awake_entities[entity]
+            entity.on_sleep(self)
+
+    # Runs callback(*args) the given number of ticks from now, returns the ScheduledEvent.
+    def schedule(self, ticks, callback, *args):
+        return self.scheduler.schedule(self.global_ticks+ticks, callback, *args)
+
+    # True if ticking the game would do nothing but look after itself: nobody is playing, nothing is
+    # awake, fighting or waiting to be said, and nothing is scheduled except evicting players, saving
+    # and respawns. Respawns that come due while nobody's there can wait until someone comes back.
+    def is_idle(self):
+        housekeeping = (self.evict_event is not None) + (self.snapshot_event is not None) + \
+            sum(self.pending_respawns.values())
+        return not len(self.players) and not self.awake_entities and not self.pending_attacks and \
+            len(self.scheduler) <= housekeeping and not any(mech.outbox.pending_count() for mech in self.mechs)
+
+    # Moves the clock on without running anything, for time that passed while the game was idle.
+    # Evicting and saving that came due in that time happen on the next update.
+    def skip_ticks(self, count):
+        self.global_ticks += count
+
+    # Only awake entities, and actions and entities with something due this tick, do any work.
+    def update(self):
+        self.global_ticks+=1
+        stats = self.stats if self.stats.enabled else None
+        if stats:
+            start = timer()
+
+        for entity in list(self.awake_entities):
+            entity.update(self)
+        if stats:
+            entities_done = timer()
+            stats.add_phase('entities', entities_done - start)
+
+        self.scheduler.run_due(self.global_ticks)
+        if stats:
+            scheduler_done = timer()
+            stats.add_phase('scheduler', scheduler_done - entities_done)
+
+        if self.pending_attacks:
+            self.resolve_attacks()
+        if stats:
+            combat_done = timer()
+            stats.add_phase('combat', combat_done - scheduler_done)
+
+        self.flush()
+        if stats:
+            finished = timer()
+            stats.add_phase('flush', finished - combat_done)
+            stats.add_phase('game update', finished - start)
+
+    # Sends what was said, and saves what changed, during this tick or command.
+    # The mechs share the rate limit, so each flush starts from the next mech along to stop the
+    # first mechs taking every token while the others' messages wait.
+    def flush(self):
+        start = self.next_flush_mech
+        for mech in self.mechs[start:] + self.mechs[:start]:
+            mech.outbox.flush()
+        self.next_flush_mech = (start + 1) % len(self.mechs)
+        if self.game_store:
+            self.game_store.flush(self.global_ticks)
+
+    # Saving
+
+    # Adds an event to the save's journal, if the game is being saved.
+    # Events hold the new state of something rather than how it changed, so they can be replayed over a snapshot.
+    def record(self, *event):
+        if self.game_store:
+            self.game_store.record(event)
+
+    # These check for a save themselves so the state isn't worked out for nothing.
+    def record_player(self, player):
+        if self.game_store:
+            self.record('player', *self.player_state(player))
+
+    def record_enemy(self, entity):
+        if self.game_store and isinstance(entity, SimpleEnemy):
+            self.record('enemy', *self.enemy_state(entity))
+
+    def player_state(self, player):
+        mech = player.mech
+        return (player.name, player.level, player.xp, mech.id if mech else None, mech.bodypart_of(player) if mech else None)
+
+    def enemy_state(self, enemy):
+        spawn_table = enemy.spawn_table.name if enemy.spawn_table else None
+        return (enemy.id, enemy.name, enemy.health, enemy.location, enemy.is_attacking, spawn_table)
+
+    # Everything needed to carry on the game, as numbers, strings, lists and tuples.
+    def save_state(self):
+        return (Game.SNAPSHOT_VERSION, self.global_ticks, self.next_entity_id,
+                [(mech.health, mech.position) for mech in self.mechs],
+                [self.player_state(player) for player in self.players],
+                [self.enemy_state(entity) for entity in self.entities if isinstance(entity, SimpleEnemy)])
+
+    # Version 1 saves come from before there could be more than one mech, everything in them is about the first.
+    def restore_state(self, state):
+        if state[0] == 1:
+            version, self.global_ticks, self.next_entity_id, health, position, players, enemies = state
+            mechs = [(health, position)]
+        else:
+            version, self.global_ticks, self.next_entity_id, mechs, players, enemies = state
+        for mech_id, (health, position) in enumerate(mechs[:len(self.mechs)]):
+            self.apply_event(('mech', mech_id, health))
+            self.apply_event(('position', mech_id, position))
+        for player_state in players:
+            self.apply_event(('player',) + tuple(player_state))
+        # A snapshot can hold a lot of enemies, so new ones are added all at once rather than one event at a time.
+        saved_enemies = []
+        for enemy_state in enemies:
+            if self.entities.get(enemy_state[0]):
+                self.apply_event(('enemy',) + tuple(enemy_state))
+            else:
+                saved_enemies.append(self.saved_enemy(*enemy_state))
+        self.add_saved_enemies(saved_enemies)
+
+    # Makes the enemy a saved state describes, without adding it to the game.
+    # Saves from before spawn tables don't say which table an enemy came from.
+    def saved_enemy(self, entity_id, type_name, health, location, is_attacking, *table_name):
+        enemy_type = Game.enemy_types[type_name]
+        enemy = self.new_enemy(enemy_type, location)
+        enemy.id = entity_id
+        enemy.health = health
+        enemy.is_attacking = is_attacking
+        if table_name:
+            enemy.spawn_table = self.get_spawn_table(table_name[0])
+        else:
+            enemy.spawn_table = self.find_spawn_table(enemy_type, location)
+        return enemy
+
+    # Like add_entity for a lot of saved enemies that already have their ids. They aren't recorded as they're already saved.
+    def add_saved_enemies(self, enemies):
+        # Into the index first, while their locations are still quick to read from the enemies themselves.
+        self.entities.add_all(enemies)
+        self.enemy_store.add_all(enemies)
+        for enemy in enemies:
+            self.next_entity_id = max(self.next_entity_id, enemy.id + 1)
+            if enemy.spawn_table:
+                self.spawn_population[enemy.spawn_table] += 1
+        self.room_views.clear()
+
+    # Events from version 1 journals don't say which mech they're about, so they're about the first.
+    def apply_event(self, event):
+        kind = event[0]
+        if kind == 'position':
+            mech_id, position = event[1:] if len(event) == 3 else (0, event[1])
+            if mech_id < len(self.mechs):
+                self.place_mech(self.mechs[mech_id], position)
+        elif kind == 'mech':
+            mech_id, health = event[1:] if len(event) == 3 else (0, event[1])
+            if mech_id < len(self.mechs):
+                self.mechs[mech_id].health = health
+        elif kind == 'player':
+            if len(event) == 5:
+                name, level, xp, bodypart = event[1:]
+                mech_id = 0
+            else:
+                name, level, xp, mech_id, bodypart = event[1:]
+            player = self.players.get(name)
+            if not player:
+                player = Player(name)
+                self.players.join(player, self.global_ticks)
+                # A save from a game with more mechs than this one can have pilots of mechs we don't have,
+                # they're given a seat in the least crowded mech we do have.
+                if mech_id is None or mech_id >= len(self.mechs) or bodypart is None:
+                    mech = min(self.mechs, key=lambda mech: len(mech.pilots()))
+                    bodypart = mech.leastPopulousMechBodyPart()
+                else:
+                    mech = self.mechs[mech_id]
+                player.mech = mech
+                mech.add_pilot(bodypart, player)
+            player.level = level
+            player.xp = xp
+        elif kind == 'leave':
+            player = self.players.leave(event[1])
+            if player and player.mech:
+                player.mech.remove_pilot(player)
+        elif kind == 'enemy':
+            entity_id, type_name, health, location, is_attacking = event[1:6]
+            enemy = self.entities.get(entity_id)
+            if not enemy:
+                self.add_entity(self.saved_enemy(*event[1:]), entity_id)
+                return
+            if enemy.location != location:
+                self.move_entity(enemy, location)
+            enemy.health = health
+            enemy.is_attacking = is_attacking
+        elif kind == 'removed':
+            # The snapshot may already be from after the enemy was removed, if the game stopped just after writing it.
+            entity = self.entities.get(event[1])
+            if entity:
+                self.remove_entity(entity)
+
+    # Carries on from the snapshot and journal at save_path, or starts a new game there.
+    def load_game(self, save_path):
+        game_store = GameStore(save_path)
+        snapshot, records = game_store.load()
+        if snapshot:
+            self.restore_state(snapshot)
+        else:
+            self.add_initial_entities()
+        for tick, events in records:
+            self.global_ticks = tick
+            for event in events:
+                self.apply_event(event)
+
+        # Enemies that were fighting a piloted mech carry on:
+        for room_id in self.mechs_by_room:
+            if self.piloted_mechs_in_room(room_id):
+                self.wake_attackers(room_id)
+        self.schedule_missing_respawns()
+
+        self.game_store = game_store
+        game_store.start()
+        # Starting with a fresh snapshot keeps the journal short.
+        game_store.snapshot(self.save_state())
+        self.snapshot_event = self.schedule(Game.SNAPSHOT_INTERVAL, self.save_snapshot)
+
+    def save_snapshot(self):
+        self.flush()
+        self.game_store.snapshot(self.save_state())
+        self.snapshot_event = self.schedule(Game.SNAPSHOT_INTERVAL, self.save_snapshot)
+
+    # Finishes saving the game. Call this when the game is being shut down.
+    def close(self):
+        if self.game_store:
+            self.flush()
+            self.game_store.snapshot(self.save_state())
+            self.game_store.close()
+            self.game_store = None
+
+    def on_mech_damaged(self, mech, attack_text, power):
+        mech.health-=power
+        self.record('mech', mech.id, mech.health)
+        if mech.health<=0:
+            self.sendMessage(mech, attack_text + ' You lose ' + str(power)+' health. You have zero health.')
+            self.sendMessage(mech, attack_text + ' AdventureBot explodes. Bits of robot are all over the place.')
+        else:
+            self.sendMessage(mech, attack_text + ' You lose ' + str(power)+' health ('+ str(mech.health)+' health remaining).')
+
+    # Trims whitespace from a string and makes it lowercase
+    def trimAndLowerCase(self, text):
+        return text
+
+    def add_player(self, playerName, player, mech, bodypart): # string, Player, Mech, int
+        self.players.join(player, self.global_ticks)
+        player.mech = mech
+        first_in_room = not self.piloted_mechs_in_room(mech.position)
+        mech.add_pilot(bodypart, player)
+        if first_in_room:
+            self.wake_attackers(mech.position)
+        self.sendMessage(mech, player.formal_identifier()+' is now piloting '+mech.name+'\'s '+mech.parts[bodypart].name+'.')
+        self.record_player(player)
+
+    def remove_player(self, playerName):
+        player = self.players.leave(playerName)
+        if player:
+            player.attack_action.stop(self)
+            self.sendMessage(player.mech, player.formal_identifier()+' has left '+player.mech.name+'.')
+            player.mech.remove_pilot(player)
+            # An empty mech stops where it is, and anything fighting it stops once no piloted mech is left in the room.
+            if not player.mech.pilots():
+                player.mech.travel_action.stop(self)
+                if not self.piloted_mechs_in_room(player.mech.position):
+                    self.sleep_attackers(player.mech.position)
+            self.record('leave', playerName)
+        return player
+
+    # Called when a player changes their nick in the chat room.
+    def rename_player(self, oldName, newName):
+        if oldName in self.players and not newName in self.players:
+            self.players.rename(oldName, newName, self.global_ticks)
+            self.record('leave', oldName)
+            self.record_player(self.players.get(newName))
+
+    def get_player(self, playerName):
+        return self.players.get(playerName)
+
+    def evict_expired_players(self):
+        for name in self.players.expired(self.global_ticks - Game.SESSION_TIMEOUT):
+            self.remove_player(name)
+        self.evict_event = self.schedule(Game.SESSION_CHECK_INTERVAL, self.evict_expired_players)
+
+    # Says something to a mech's pilots.
+    # Messages are buffered and sent when the current tick or command is finished.
+    def sendMessage(self, mech, message):
+        if self.stats.enabled:
+            self.stats.lines += 1
+        mech.outbox.add(message)
+
+    # Says something that happened in a room to every mech in or next to it.
+    def sendMessageNear(self, room_id, message):
+        for mech in self.mechs_near(room_id):
+            self.sendMessage(mech, message)
+
+    # Where a mech's outbox sends its messages. With one mech everyone in the chat room is a pilot, so it's sent to the room.
+    def send_to_mech(self, mech, text):
+        if len(self.mechs) == 1:
+            names = None
+        else:
+            names = [player.name for player in mech.pilots()]
+            if not names:
+                return
+        if self.stats.enabled:
+            self.stats.messages_sent += self.sends_per_message(mech)
+        if names is None:
+            self.send(text)
+        else:
+            self.send(text, names)
+
+    # How many messages the chat server gets for each message to a mech.
+    def sends_per_message(self, mech):
+        if len(self.mechs) == 1:
+            return 1
+        return len(mech.pilots())
+
+    # Given a list of strings it will join them with commas, properly ending it with 'and'
+    # e.g.  ["cat", "dog", "bird"] -> "cat, dog and bird"
+    # warning: modifies input array.
+    def join_strings_with_commas_and_and(self, list):
+        if len(list) > 1:
+            last_item = list[-1]
+            list.pop()
+            result = ', '.join(list)
+            result += ' and ' + last_item
+            return result
+        elif len(list)==1:
+            return list[0]
+        else:
+            # TODO: assert
+            pass
+
+    def get_available_direction_text(self, room_id): # (int)-> string
+        # Get the exits of the room:
+        directions = sorted(self.map.get_connections(room_id))
+        direction_strings = [Direction.direction_to_string(direction) for direction in directions]
+
+        if len(directions) > 1:
+            return "There are exits to the " + self.join_strings_with_commas_and_and(direction_strings) + '.'
+        elif len(directions) == 1:
+            return 'There is an exit to the ' + direction_strings[0] + '.'
+        else:
+            return ''
+
+    def get_occupants_text(self, room_id): # (int)-> string
+        entity_names = [entity.name for entity in self.get_entities_in_room(room_id)]
+        if entity_names:
+            return "There is a " + self.join_strings_with_commas_and_and(entity_names) + ' in the room.'
+        return ''
+
+    @playercmd("look(?:\s+(?:at\s+)?(\S+))?", 'look')
+    @coalesced
+    def lookCommand(self, matches, player):
+        # The command might be a description of the room or a command to look at an entity:
+        target = matches.group(1)
+        if target:
+            # Check if the target exists in our room:
+            entities_in_room=self.get_entities_in_room(player.mech.position)
+            entity_with_name = first(filter(lambda x: x.name.lower() == target, entities_in_room))
+            if entity_with_name:
+                self.sendMessage(player.mech, entity_with_name.detailed_look)
+            else:
+                self.sendMessage(player.mech, 'There is no '+target+' in here, '+player.formal_identifier()+'.')
+        elif player.mech.last_look != (self.global_ticks, player.mech.position):
+            # Otherwise another pilot has already looked, or the mech has just moved, this tick.
+            self.look_in_room(player.mech)
+
+    # Descriptions are only read from the world the first time a room is looked at, or when
+    # the room has dropped out of the cache.
+    def get_room_view(self, room_id):
+        view = self.room_views.pop(room_id, None)
+        if view is None:
+            description = self.map.get_description(room_id)
+            view = RoomView("You see " + description if description else "You are now in room " + str(room_id))
+            if len(self.room_views) >= Game.ROOM_VIEW_CACHE_SIZE:
+                self.room_views.popitem(last=False)
+        self.room_views[room_id] = view
+        return view
+
+    def forget_exits(self, room_a_id, room_b_id):
+        for room_id in (room_a_id, room_b_id):
+            view = self.room_views.get(room_id)
+            if view:
+                view.exits = None
+
+    def forget_occupants(self, room_id):
+        view = self.room_views.get(room_id)
+        if view:
+            view.occupants = None
+
+    def look_in_room(self, mech):
+        mech.last_look = (self.global_ticks, mech.position)
+        view = self.get_room_view(mech.position)
+        if view.exits is None:
+            view.exits = self.get_available_direction_text(mech.position)
+        if view.occupants is None:
+            view.occupants = self.get_occupants_text(mech.position)
+
+        self.sendMessage(mech, view.description)
+        if view.exits:
+            self.sendMessage(mech, view.exits)
+        if view.occupants:
+            self.sendMessage(mech, view.occupants)
+
+    # Attacks aren't made straight away, they're all settled together at the end of the tick by resolve_attacks.
+    def attack_target(self, player, entity):
+        attackers = self.pending_attacks.get(entity)
+        if attackers is None:
+            self.pending_attacks[entity] = [player]
+        else:
+            attackers.append(player)
+
+    # Settles the attacks made this tick one target at a time, so however many pilots stomp on
+    # an enemy it takes one hit and gets one message from each mech attacking it. The enemies' health is all
+    # taken off in one go through the EnemyStore, and the xp for everything killed is handed out in one pass
+    # over the pilots of the mechs that killed it.
+    def resolve_attacks(self):
+        attacks = self.pending_attacks
+        self.pending_attacks = OrderedDict()
+        powers = dict((target, Game.ATTACK_POWER * len(attackers)) for target, attackers in attacks.items())
+        stored = [target for target in attacks if isinstance(target, SimpleEnemy)]
+        dead = set(self.enemy_store.damage([target.slot for target in stored], [powers[target] for target in stored]))
+        for target in attacks:
+            if not isinstance(target, SimpleEnemy):
+                target.health -= powers[target]
+                if target.health <= 0:
+                    dead.add(target)
+
+        kills_xp = OrderedDict() # Mech -> [xp, ...]
+        for target, attackers in attacks.items():
+            attackers_by_mech = OrderedDict() # Mech -> [Player, ...]
+            for player in attackers:
+                attackers_by_mech.setdefault(player.mech, []).append(player)
+            for mech, mech_attackers in attackers_by_mech.items():
+                names = self.join_strings_with_commas_and_and([player.formal_identifier() for player in mech_attackers])
+                command = ' commands ' if len(mech_attackers) == 1 else ' command '
+                self.sendMessageNear(target.location, names + command + mech.name + ' to stomp on the ' + target.name + '.')
+            target.on_damaged(self, powers[target], target in dead)
+            if target in dead:
+                # We remove the entity from the world, and stop anyone still attacking it.
+                for mech in attackers_by_mech:
+                    self.sendMessage(mech, 'The '+target.name+' is dead. You gain '+str(target.xp)+'xp.')
+                    kills_xp.setdefault(mech, []).append(target.xp)
+                self.remove_entity(target)
+                for mech in self.mechs_near(target.location):
+                    for player in mech.pilots():
+                        if player.attack_action.target is target:
+                            player.attack_action.stop(self)
+                            player.attack_action.target = None
+            else:
+                self.record_enemy(target)
+        for mech, mech_kills_xp in kills_xp.items():
+            self.gain_xp(mech, mech_kills_xp)
+
+    @playercmd("leave$", 'leave')
+    def leaveCommand(self, matches, player):
+        self.remove_player(player.name)
+
+    @playercmd("attack\s*(\S+)?$", 'attack')
+    @coalesced
+    def attackCommand(self, matches, player):
+        if matches.group(1)==None:
+            self.sendMessage(player.mech, "What should I attack?")
+        else:
+            target = matches.group(1)
+            # Check if the target exists in our room:
+            entities_in_room=self.get_entities_in_room(player.mech.position)
+            entity_with_name = first(filter(lambda x: x.name.lower() == target, entities_in_room))
+
+            if entity_with_name:
+                player.attack_action.target = entity_with_name
+                player.attack_action.start(self)
+            else:
+                self.sendMessage(player.mech, 'There is no '+target+' in here, '+player.formal_identifier()+'.')
+
+    @playercmd("(?:go\s+)?"+direction_regex(), *(['go'] + Direction.long_text + Direction.abbreviated_text))
+    def direction_command(self, matches, player): # Direction
+        direction_text = matches.group(1)
+        direction = self.map.get_direction_from_string(direction_text)
+
+        mech = player.mech
+        mech.travel_action.stop(self)
+        if not self.move_mech(mech, direction):
+            # Send a message telling the users that we can't go in that direction.
+            self.sendMessage(mech, "There is no exit in that direction.")
+
+    @playercmd("go\s+to\s+(\d+)$", 'go')
+    @coalesced
+    def travel_command(self, matches, player):
+        mech = player.mech
+        target = int(matches.group(1))
+        if target >= self.map.room_count():
+            self.sendMessage(mech, "I don't know the way to room "+str(target)+'.')
+            return
+        route = self.map.short_route(mech.position, target, Game.MAX_TRAVEL_DISTANCE)
+        if route is None:
+            self.sendMessage(mech, "Room "+str(target)+" is too far away, you can only set a course for rooms up to "+
+                             str(Game.MAX_TRAVEL_DISTANCE)+" rooms away.")
+        elif route[1] == 0:
+            self.sendMessage(mech, "You are already there.")
+        else:
+            self.sendMessage(mech, player.formal_identifier()+' sets a course for room '+str(target)+', '+str(route[1])+' rooms away.')
+            mech.travel_action.stop(self)
+            mech.travel_action.target = target
+            mech.travel_action.start(self)
+
+    # Moves a mech to the next room in a direction. Returns False if there's no exit that way.
+    def move_mech(self, mech, direction):
+        previous_room = mech.position
+        next_room = self.map.get_connection(previous_room, direction)
+        if next_room == NO_ROOM:
+            return False
+        self.place_mech(mech, next_room)
+        self.record('position', mech.id, next_room)
+
+        # Stop any current attacks we are making:
+        for player in mech.pilots():
+            player.on_user_left_room(self)
+        # Enemies only go back to sleep when there's no mech left in the room to fight:
+        left_empty = not self.mechs_in_room(previous_room)
+        for entity in self.get_entities_in_room(previous_room):
+            entity.on_user_left_room(self, mech)
+            if left_empty:
+                self.sleep_entity(entity)
+
+        # Send a message saying we have moved, and display the description for the new area.
+        # Send messages to any entities to let them know we have entered the area
+        self.sendMessage(mech, "You go " + Direction.long_text[direction]+'.')
+        self.look_in_room(mech)
+        # Update any entities:
+        entities_in_room=self.get_entities_in_room(mech.position)
+        for entity in entities_in_room:
+            entity.on_user_entered_room(self, mech)
+        return True
+
+    # Looks the command up by its first word, and runs the first handler whose pattern matches.
+    # Returns True if a command was run.
+    def executePlayerCommand(self, text, player): # (string, Player)
+        words = text.split(None, 1)
+        if not words:
+            return False
+        for pattern, handler in self.commands.get(words[0], ()):
+            matchObject = pattern.match(text)
+            if matchObject:
+                if getattr(handler, 'coalesced', False):
+                    if player.last_command == (self.global_ticks, text):
+                        return True
+                    player.last_command = (self.global_ticks, text)
+                if self.stats.enabled:
+                    start = timer()
+                    handler(matchObject, player)
+                    self.stats.add_command(handler.__name__, timer() - start)
+                else:
+                    handler(matchObject, player)
+                return True
+        return False
+
+    # Players join the mech with the fewest pilots, or the one they ask for with "join <mech number>".
+    def processUnsignedPlayer(self, input, playerName): # (string, string)
+        # First check if the player is attempting to sign up:
+        if input and input[0] == "join":
+            if len(input) > 1 and input[1].isdigit() and 1 <= int(input[1]) <= len(self.mechs):
+                mech = self.mechs[int(input[1]) - 1]
+            else:
+                mech = min(self.mechs, key=lambda mech: len(mech.pilots()))
+            # Create a new player:
+            player = Player(playerName)
+            # Assign a bodypart:
+            bodypart = mech.leastPopulousMechBodyPart()
+            self.add_player(playerName, player, mech, bodypart)
+            self.sendMessage(mech, 'Welcome to the game, '+player.formal_identifier()+'!')
+            #    '<html><body><b>Welcome</b> to the game, '+player.formal_identifier()+'!</body></html>')
+
+    # Handles a line said in the game's chat room by the player with the given name.
+    def handle_message(self, name, body):
+        text = body.strip().lower()
+        # The arguments are only formatted if debug logging is on.
+        logging.debug('Input received was: %s', text)
+
+        # Check if the player is in the database, if not tell them to join:
+        player = self.get_player(name)
+        if player:
+            self.players.seen(name, self.global_ticks)
+            self.executePlayerCommand(text, player)
+        else:
+            logging.debug('executing unsigned player command for %s', name)
+            self.processUnsignedPlayer(text.split(), name)
+        self.flush()
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+# Runs tick() every interval seconds on a thread of its own, which is the only thread that touches the games.
+# Anything another thread wants done to a game is posted, and runs on the loop's thread just before the next tick.
+#
+# Ticks are on a fixed timestep: each one is due an interval after the last one was due, not an interval after
+# it finished, so slow ticks don't make the loop drift. A loop that falls behind runs the ticks it missed back to back
+# to catch up, unless it's more than MAX_CATCH_UP ticks behind, when it drops them rather than racing through them.
+#
+# If is_idle is given, the loop asks it after every tick whether there's any point carrying on. When there
+# isn't, it hibernates: it stops ticking and waits, without using any CPU, until something is posted. Then
+# it calls resume with the number of seconds it slept, runs what was posted and starts ticking again.
+#
+# If max_posted is given, no more than that many callbacks can be waiting. try_post refuses any more,
+# so a flood of messages is turned away rather than queueing up work the loop can never catch up on.
+class GameLoop(object):
+    MAX_CATCH_UP = 10
+
+    def __init__(self, interval, tick, clock=time.time, sleep=time.sleep, is_idle=None, resume=None, max_posted=0):
+        self.interval = interval
+        self.tick = tick
+        self.clock = clock
+        self.sleep = sleep
+        self.is_idle = is_idle
+        self.resume = resume
+        self.inbox = Queue(max_posted) # (callback, args)
+        self.running = False
+        self.thread = None
+        self.ticks = 0
+        self.late_ticks = 0 # Ticks that finished after the next one was due.
+        self.dropped_ticks = 0
+        self.hibernations = 0
+        self.refused = 0 # Callbacks try_post turned away.
+
+    # Runs callback(*args) on the loop's thread before the next tick. Can be called from any thread.
+    # Waits for room if too much has been posted already.
+    def post(self, callback, *args):
+        self.inbox.put((callback, args))
+
+    # Like post, but returns False rather than waiting if too much has been posted already.
+    def try_post(self, callback, *args):
+        try:
+            self.inbox.put_nowait((callback, args))
+        except Full:
+            self.refused += 1
+            return False
+        return True
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='GameLoop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    # Stops after the current tick, running anything that's already been posted.
+    def stop(self):
+        self.running = False
+        # Wakes the loop if it's hibernating:
+        self.post(lambda: None)
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        next_tick = self.clock() + self.interval
+        while self.running:
+            delay = next_tick - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+                continue
+            behind = int(-delay / self.interval)
+            if behind > GameLoop.MAX_CATCH_UP:
+                logging.warning('Game loop is %d ticks behind, dropping them.' % behind)
+                self.dropped_ticks += behind
+                next_tick += behind * self.interval
+            self.run_posted()
+            self.call(self.tick)
+            self.ticks += 1
+            next_tick += self.interval
+            if self.clock() > next_tick:
+                self.late_ticks += 1
+            if self.is_idle and self.running and self.inbox.empty() and self.is_idle():
+                self.hibernate()
+                next_tick = self.clock()
+        self.run_posted()
+
+    def hibernate(self):
+        self.hibernations += 1
+        start = self.clock()
+        # A get with no timeout blocks until something is posted, where one with a timeout would poll.
+        callback, args = self.inbox.get()
+        if self.resume:
+            self.call(self.resume, self.clock() - start)
+        self.call(callback, *args)
+
+    def run_posted(self):
+        while True:
+            try:
+                callback, args = self.inbox.get_nowait()
+            except Empty:
+                return
+            self.call(callback, *args)
+
+    # One bad command or tick shouldn't stop the games.
+    def call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception('Error in the game loop')
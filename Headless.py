@@ -0,0 +1,83 @@
+# Runs a Game without errbot or a chat server, for testing and benchmarking.
+#
+#   python Headless.py transcript.txt
+#
+# replays a transcript and prints everything the game says. Transcripts have one line per step:
+#   <player name>: <what they say>
+#   tick <count>
+# Blank lines and lines starting with # are ignored.
+from __future__ import print_function
+import sys
+from Game import Game
+
+# A clock that only moves when it's told to, so a test runs the same however fast the computer is.
+class ManualClock(object):
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+# Stands in for the chat room, keeping every message the game sends.
+# Messages sent privately to players are kept as '[name, name] text'.
+class FakeTransport(object):
+    def __init__(self):
+        self.messages = []
+
+    def send(self, text, names=None):
+        if names is not None:
+            text = '[' + ', '.join(names) + '] ' + text
+        self.messages.append(text)
+
+    # Returns the messages sent since the last call.
+    def take(self):
+        messages = self.messages
+        self.messages = []
+        return messages
+
+# A Game with a FakeTransport and a ManualClock that advances by one tick every tick.
+# The game's random numbers are seeded too, so enemies pick the same attacks every run.
+class HeadlessGame(object):
+    TICK_SECONDS = 0.1
+
+    def __init__(self, world_file=None, world_map=None, save_path=None, seed=0, enemies=None, mech_count=None):
+        self.clock = ManualClock()
+        self.transport = FakeTransport()
+        self.game = Game(self.transport.send, world_file, save_path, world_map, clock=self.clock, enemies=enemies,
+                         mech_count=mech_count, seed=seed)
+
+    # Does what callback_message does when a player says something in the game's room.
+    def say(self, name, text):
+        self.game.handle_message(name, text)
+
+    def tick(self, count=1):
+        for tick in range(count):
+            self.clock.advance(HeadlessGame.TICK_SECONDS)
+            self.game.update()
+
+    # Runs each line of a transcript, returns the messages the game sent.
+    def replay(self, lines):
+        for line_number, line in enumerate(lines):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            words = line.split()
+            if words[0] == 'tick' and len(words) == 2:
+                self.tick(int(words[1]))
+            elif ':' in line:
+                name, text = line.split(':', 1)
+                self.say(name.strip(), text.strip())
+            else:
+                raise ValueError('transcript line ' + str(line_number+1) + ': ' + line)
+        return self.transport.take()
+
+def read_transcript(path):
+    with open(path) as transcript_file:
+        return transcript_file.readlines()
+
+if __name__ == '__main__':
+    for message in HeadlessGame().replay(read_transcript(sys.argv[1])):
+        print(message)
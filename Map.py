@@ -1,87 +1,339 @@
-class Direction:
-    NO_DIRECTION = -1
-    NORTH = 0
-    NORTHEAST = 1
-    EAST = 2
-    SOUTHEAST = 3
-    SOUTH = 4
-    SOUTHWEST = 5
-    WEST = 6
-    NORTHWEST = 7
-    long_text = ["north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest"]
-    abbreviated_text = ["n", "ne", "e", "se", "s", "sw", "w", "nw"]
-
-    @staticmethod
-    def direction_to_string(direction):
-        # TODO: find the equivalent of an assert
-        return Direction.long_text[direction]
-
-class Room:
-    def __init__(self):
-        self.connections = {}
-        self.id = 0
-
-    def __repr__(self):
-        return 'Room id ' + str(self.id) + ' connections ' + str(self.connections)
-
-# Map handles the creation of the world map and the positioning of the player.
-class Map:
-
-#Input should be any data to associate with the room ( RoomData class ) and a map
-    #maybe a map of data?
-    # we don't even need to do that, we can handle stuff like that outside this class. but then where?
-    def __init__(self):
-        self.position = 0
-        self.rooms = {}
-
-        # Create the rooms:
-        self.make_connection(0, 1, Direction.NORTH)
-        self.make_connection(1, 2, Direction.NORTH)
-        self.make_connection(2, 3, Direction.NORTHEAST)
-        self.make_connection(2, 4, Direction.NORTHWEST)
-
-    def get_connections(self, room_id):
-        return self.rooms[room_id].connections
-
-    def get_direction_from_string(self, text):
-        if (text in Direction.long_text):
-            return Direction.long_text.index(text)
-        elif (text in Direction.abbreviated_text):
-            return Direction.abbreviated_text.index(text)
-
-        return Direction.NO_DIRECTION
-
-    # Moves the player in the direction given. If the direction isn't available, returns false.
-    def go_direction(self, direction): # int (Direction)
-        room = self.get_room(self.position)
-        if direction in room.connections:
-            self.position = room.connections[direction]
-            return True
-        else:
-            return False
-
-    # private const function:
-    def opposite_direction(self, direction):
-        direction += 4
-        direction %= 8
-        return direction
-
-    # Creates and returns a new room if the given id doesn't exist
-    # Why not create all the rooms initially so I don't have to worry about this?
-    def get_room(self, room_id):
-        if room_id in self.rooms:
-            return self.rooms[room_id]
-        room = Room()
-        room.id = room_id
-        # Add the new room to the dictionary
-        self.rooms[room_id] = room
-        return room
-
-    # Todo: check if connections already contain the room id (if so, it's an error)
-    # Instead of using get_room it should just throw an error if the room doesn't exist.
-    def make_connection(self, room_a_id, room_b_id, direction):
-        room_a = self.get_room(room_a_id)
-        room_a.connections[direction] = room_b_id
-
-        room_b = self.get_room(room_b_id)
-        room_b.connections[self.opposite_direction(direction)] = room_a_id
\ No newline at end of file
+import mmap
+import struct
+import sys
+from array import array
+from collections import OrderedDict, deque
+
+# A slot in the adjacency with no room in it.
+NO_ROOM = -1
+
+class Direction:
+    NO_DIRECTION = -1
+    NORTH = 0
+    NORTHEAST = 1
+    EAST = 2
+    SOUTHEAST = 3
+    SOUTH = 4
+    SOUTHWEST = 5
+    WEST = 6
+    NORTHWEST = 7
+    COUNT = 8
+    long_text = ["north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest"]
+    abbreviated_text = ["n", "ne", "e", "se", "s", "sw", "w", "nw"]
+
+    @staticmethod
+    def direction_to_string(direction):
+        # TODO: find the equivalent of an assert
+        return Direction.long_text[direction]
+
+# A view of one room, made on demand by Map.get_room. Changing it doesn't change the map.
+# connections has a slot for each Direction, holding the id of the room that way or NO_ROOM.
+class Room(object):
+    __slots__ = ('id', 'connections')
+
+    def __init__(self):
+        self.connections = (NO_ROOM,) * Direction.COUNT
+        self.id = 0
+
+    def __repr__(self):
+        return 'Room id ' + str(self.id) + ' connections ' + str(self.connections)
+
+# An array of int32s kept in a memory-mapped file, so a large world doesn't have to be read in.
+# The mapping is copy-on-write: changes are only seen by this process, the file is never written.
+class MappedSlots(object):
+    def __init__(self, mapping, offset, length):
+        self.mapping = mapping
+        self.offset = offset
+        self.length = length
+
+    def __getitem__(self, index):
+        return struct.unpack_from('<i', self.mapping, self.offset + index*4)[0]
+
+    def __setitem__(self, index, value):
+        struct.pack_into('<i', self.mapping, self.offset + index*4, value)
+
+    def __len__(self):
+        return self.length
+
+# Room descriptions stored one after another in a memory-mapped file, found using a table of offsets.
+class MappedDescriptions(object):
+    def __init__(self, mapping, offsets_start, text_start, count):
+        self.mapping = mapping
+        self.offsets_start = offsets_start
+        self.text_start = text_start
+        self.count = count
+
+    def get(self, room_id, default=None):
+        if room_id < 0 or room_id >= self.count:
+            return default
+        start, end = struct.unpack_from('<II', self.mapping, self.offsets_start + room_id*4)
+        if start == end:
+            return default
+        return self.mapping[self.text_start+start:self.text_start+end].decode('utf-8')
+
+# The shortest routes from every room to one target room, found with a breadth first search.
+# next_direction[room] is the way to go from room to get closer to the target, distance[room] is
+# how many moves it takes. Both are NO_ROOM for rooms that can't reach the target.
+class PathTable(object):
+    def __init__(self, world_map, target):
+        room_count = world_map.room_count()
+        self.target = target
+        self.next_direction = array('b', [NO_ROOM]) * room_count
+        self.distance = array('i', [NO_ROOM]) * room_count
+        self.distance[target] = 0
+
+        # Connections always go both ways, so walking out from the target finds the way back to it.
+        queue = deque([target])
+        while queue:
+            room_id = queue.popleft()
+            for direction in range(Direction.COUNT):
+                neighbour = world_map.get_connection(room_id, direction)
+                if neighbour != NO_ROOM and self.distance[neighbour] == NO_ROOM:
+                    self.distance[neighbour] = self.distance[room_id] + 1
+                    self.next_direction[neighbour] = world_map.opposite_direction(direction)
+                    queue.append(neighbour)
+
+    # A new connection between two rooms only changes the table if it gives one of them a shorter route.
+    def is_affected_by(self, room_a_id, room_b_id):
+        if room_a_id >= len(self.distance) or room_b_id >= len(self.distance):
+            return True
+        distance_a = self.distance[room_a_id]
+        distance_b = self.distance[room_b_id]
+        if distance_a == NO_ROOM and distance_b == NO_ROOM:
+            return False
+        if distance_a == NO_ROOM or distance_b == NO_ROOM:
+            return True
+        return abs(distance_a - distance_b) > 1
+
+# Map handles the creation of the world map. position is the room the mechs start in, the
+# game keeps track of where each of them has got to.
+# Rooms are numbered from 0, and each has a slot for every Direction in the adjacency,
+# holding the id of the room in that direction or NO_ROOM.
+class Map:
+
+#Input should be any data to associate with the room ( RoomData class ) and a map
+    #maybe a map of data?
+    # we don't even need to do that, we can handle stuff like that outside this class. but then where?
+
+    # How many targets we keep PathTables for.
+    PATH_CACHE_SIZE = 32
+
+    def __init__(self, room_count=0):
+        self.position = 0
+        self.adjacency = array('i', [NO_ROOM]) * (room_count * Direction.COUNT)
+        self.descriptions = {} # room id -> string, anything with a get method will do.
+        self.path_tables = OrderedDict() # target room id -> PathTable, least recently used first.
+        # Called with (room_a_id, room_b_id) after a connection is made, by anything keeping what it knows about rooms.
+        self.connection_listeners = []
+
+    def room_count(self):
+        return len(self.adjacency) // Direction.COUNT
+
+    # Makes sure the map has a room with the given id.
+    def add_room(self, room_id):
+        missing = room_id + 1 - self.room_count()
+        if missing <= 0:
+            return
+        if not isinstance(self.adjacency, array):
+            # A memory-mapped map can't grow, so copy it into memory first:
+            self.adjacency = array('i', (self.adjacency[i] for i in range(len(self.adjacency))))
+        self.adjacency.extend(array('i', [NO_ROOM]) * (missing * Direction.COUNT))
+        # New rooms aren't in the path tables:
+        self.path_tables.clear()
+
+    def get_description(self, room_id):
+        return self.descriptions.get(room_id)
+
+    def get_connection(self, room_id, direction):
+        if room_id >= self.room_count() or direction < 0 or direction >= Direction.COUNT:
+            return NO_ROOM
+        return self.adjacency[room_id*Direction.COUNT + direction]
+
+    # Returns a dictionary of direction -> room id
+    def get_connections(self, room_id):
+        connections = {}
+        for direction in range(Direction.COUNT):
+            connected_room = self.get_connection(room_id, direction)
+            if connected_room != NO_ROOM:
+                connections[direction] = connected_room
+        return connections
+
+    def get_direction_from_string(self, text):
+        if (text in Direction.long_text):
+            return Direction.long_text.index(text)
+        elif (text in Direction.abbreviated_text):
+            return Direction.abbreviated_text.index(text)
+
+        return Direction.NO_DIRECTION
+
+    # private const function:
+    def opposite_direction(self, direction):
+        direction += 4
+        direction %= 8
+        return direction
+
+    # Returns a Room describing the room with the given id.
+    def get_room(self, room_id):
+        room = Room()
+        room.id = room_id
+        room.connections = tuple(self.get_connection(room_id, direction) for direction in range(Direction.COUNT))
+        return room
+
+    # Todo: check if connections already contain the room id (if so, it's an error)
+    # Rooms that don't exist yet are added.
+    def make_connection(self, room_a_id, room_b_id, direction):
+        self.add_room(max(room_a_id, room_b_id))
+        self.invalidate_paths(room_a_id, room_b_id, direction)
+        self.adjacency[room_a_id*Direction.COUNT + direction] = room_b_id
+        self.adjacency[room_b_id*Direction.COUNT + self.opposite_direction(direction)] = room_a_id
+        for listener in self.connection_listeners:
+            listener(room_a_id, room_b_id)
+
+    # Drops the path tables a new connection could change.
+    def invalidate_paths(self, room_a_id, room_b_id, direction):
+        replaced = self.get_connection(room_a_id, direction) != NO_ROOM or \
+            self.get_connection(room_b_id, self.opposite_direction(direction)) != NO_ROOM
+        if replaced:
+            # Taking a connection away can make any route longer.
+            self.path_tables.clear()
+            return
+        for target in [table.target for table in self.path_tables.values() if table.is_affected_by(room_a_id, room_b_id)]:
+            del self.path_tables[target]
+
+    def get_path_table(self, target):
+        table = self.path_tables.pop(target, None)
+        if table is None:
+            table = PathTable(self, target)
+            if len(self.path_tables) >= Map.PATH_CACHE_SIZE:
+                self.path_tables.popitem(last=False)
+        self.path_tables[target] = table
+        return table
+
+    # Returns the direction to go from one room to get closer to another, or NO_DIRECTION
+    # if you're already there or can't get there.
+    def next_direction(self, from_room_id, to_room_id):
+        if from_room_id >= self.room_count() or to_room_id >= self.room_count():
+            return Direction.NO_DIRECTION
+        return self.get_path_table(to_room_id).next_direction[from_room_id]
+
+    # Returns the number of moves between two rooms, or None if there is no way between them.
+    def distance(self, from_room_id, to_room_id):
+        if from_room_id >= self.room_count() or to_room_id >= self.room_count():
+            return None
+        distance = self.get_path_table(to_room_id).distance[from_room_id]
+        return None if distance == NO_ROOM else distance
+
+    # Returns the list of directions that leads from one room to another, or None if there isn't one.
+    def path(self, from_room_id, to_room_id):
+        if self.distance(from_room_id, to_room_id) is None:
+            return None
+        table = self.get_path_table(to_room_id)
+        directions = []
+        while from_room_id != to_room_id:
+            direction = table.next_direction[from_room_id]
+            directions.append(direction)
+            from_room_id = self.get_connection(from_room_id, direction)
+        return directions
+
+    # Returns (first direction, number of moves) of a shortest route between two rooms at most
+    # max_distance moves apart, or None if they're further apart than that. The first direction is
+    # NO_DIRECTION if they're the same room. This searches out from from_room_id rather than using a
+    # path table, so it only costs as much as the rooms within max_distance, and nothing is cached.
+    # It's for targets that keep moving, like a mech being chased, where a path table would be thrown away,
+    # and for searches on the game loop that have to stay cheap however big the world is.
+    def short_route(self, from_room_id, to_room_id, max_distance):
+        if from_room_id == to_room_id:
+            return Direction.NO_DIRECTION, 0
+        first_steps = {from_room_id: Direction.NO_DIRECTION} # room id -> first direction taken to reach it
+        edge = [from_room_id]
+        for moves in range(1, max_distance + 1):
+            next_edge = []
+            for room_id in edge:
+                first_step = first_steps[room_id]
+                for direction in range(Direction.COUNT):
+                    neighbour = self.get_connection(room_id, direction)
+                    if neighbour != NO_ROOM and neighbour not in first_steps:
+                        first_steps[neighbour] = direction if room_id == from_room_id else first_step
+                        if neighbour == to_room_id:
+                            return first_steps[neighbour], moves
+                        next_edge.append(neighbour)
+            edge = next_edge
+        return None
+
+# World files
+#
+# Text worlds are for writing by hand, one instruction per line:
+#   start <room id>
+#   room <room id> <description>
+#   connect <room id> <direction> <room id>
+# Lines starting with # are ignored.
+#
+# Binary worlds are for big maps. They are little-endian and laid out as:
+#   header: 'AMW1', room count (uint32), start room (uint32)
+#   adjacency: room count * 8 int32s
+#   description offsets: room count + 1 uint32s, into the text that follows
+#   description text: utf-8
+# The file is memory-mapped, so nothing is read until a room is visited.
+
+WORLD_MAGIC = b'AMW1'
+WORLD_HEADER = struct.Struct('<4sII')
+
+def load_world(path):
+    with open(path, 'rb') as world_file:
+        magic = world_file.read(len(WORLD_MAGIC))
+    if magic == WORLD_MAGIC:
+        return load_binary_world(path)
+    return load_text_world(path)
+
+def load_text_world(path):
+    world_map = Map()
+    with open(path) as world_file:
+        for line_number, line in enumerate(world_file):
+            words = line.split(None, 2)
+            if not words or words[0].startswith('#'):
+                continue
+            if words[0] == 'start':
+                world_map.position = int(words[1])
+            elif words[0] == 'room':
+                room_id = int(words[1])
+                world_map.add_room(room_id)
+                world_map.descriptions[room_id] = words[2].strip()
+            elif words[0] == 'connect':
+                room_a, direction, room_b = line.split()[1:]
+                world_map.make_connection(int(room_a), int(room_b), world_map.get_direction_from_string(direction))
+            else:
+                raise ValueError(path + ' line ' + str(line_number+1) + ': unknown instruction ' + words[0])
+    return world_map
+
+def load_binary_world(path):
+    with open(path, 'rb') as world_file:
+        mapping = mmap.mmap(world_file.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, room_count, start = WORLD_HEADER.unpack_from(mapping, 0)
+    adjacency_start = WORLD_HEADER.size
+    offsets_start = adjacency_start + room_count * Direction.COUNT * 4
+    text_start = offsets_start + (room_count + 1) * 4
+
+    world_map = Map()
+    world_map.position = start
+    world_map.adjacency = MappedSlots(mapping, adjacency_start, room_count * Direction.COUNT)
+    world_map.descriptions = MappedDescriptions(mapping, offsets_start, text_start, room_count)
+    return world_map
+
+def save_binary_world(world_map, path):
+    room_count = world_map.room_count()
+    adjacency = array('i', (world_map.adjacency[i] for i in range(len(world_map.adjacency))))
+    offsets = array('I', [0])
+    text = []
+    for room_id in range(room_count):
+        description = world_map.get_description(room_id) or u''
+        text.append(description.encode('utf-8'))
+        offsets.append(offsets[-1] + len(text[-1]))
+    if sys.byteorder == 'big':
+        adjacency.byteswap()
+        offsets.byteswap()
+
+    with open(path, 'wb') as world_file:
+        world_file.write(WORLD_HEADER.pack(WORLD_MAGIC, room_count, world_map.position))
+        adjacency.tofile(world_file)
+        offsets.tofile(world_file)
+        world_file.write(b''.join(text))
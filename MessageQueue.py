@@ -0,0 +1,130 @@
+import threading
+import time
+from collections import deque
+
+HTML_PREFIX = '<html>'
+
+# Limits how often something can happen. Tokens refill at rate per second, up to capacity.
+class TokenBucket(object):
+    def __init__(self, rate, capacity, clock=time.time):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.last_refill = clock()
+
+    # Returns True and uses up count tokens if a token is available. Something that costs more
+    # than one token can leave the bucket in debt, which has to be paid off before the next.
+    def take(self, count=1):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= count
+            return True
+        return False
+
+# MessageQueue collects the lines the game says during a tick or a command and sends
+# them as a single message when flushed. Messages go out through a TokenBucket so the
+# chat server's rate limit isn't hit, the ones that have to wait are queued.
+# send is a function taking the text of one message, so it can be swapped out for testing.
+# Several queues can share one limiter, to limit what they send between them. If one message is
+# sent as several (to each of a list of players, say), cost returns how many, and they're all counted.
+class MessageQueue(object):
+    def __init__(self, send, rate, burst, max_message_length=4000, clock=time.time, limiter=None, cost=None):
+        self.send = send
+        self.limiter = limiter or TokenBucket(rate, burst, clock)
+        self.cost = cost
+        self.max_message_length = max_message_length
+        self.lines = [] # Lines added since the last flush.
+        self.pending = deque() # Messages waiting on the rate limiter.
+        self.lock = threading.Lock()
+
+        # Backpressure metrics:
+        self.lines_added = 0
+        self.messages_sent = 0
+        self.messages_delayed = 0 # Flushes that left messages waiting on the rate limiter.
+        self.most_pending = 0
+
+    def add(self, line):
+        with self.lock:
+            self.lines.append(line)
+            self.lines_added += 1
+
+    # Turns the lines added so far into messages and sends as many as the rate limit allows.
+    def flush(self):
+        with self.lock:
+            for line in self.lines:
+                self._queue_line(line)
+            self.lines = []
+            self._drain()
+
+    # Sends waiting messages if the rate limit now allows it, without taking any new lines.
+    def drain(self):
+        with self.lock:
+            self._drain()
+
+    def pending_count(self):
+        return len(self.pending)
+
+    # Appends a line to the last waiting message when possible. Html messages can't be
+    # mixed with plain text so they are always sent on their own.
+    def _queue_line(self, line):
+        if not line.startswith(HTML_PREFIX) and self.pending:
+            last = self.pending[-1]
+            if not last.startswith(HTML_PREFIX) and len(last) + len(line) < self.max_message_length:
+                self.pending[-1] = last + '\n' + line
+                return
+        self.pending.append(line)
+
+    def _drain(self):
+        while self.pending and self.limiter.take(self.cost() if self.cost else 1):
+            self.send(self.pending.popleft())
+            self.messages_sent += 1
+        if self.pending:
+            self.messages_delayed += 1
+            self.most_pending = max(self.most_pending, len(self.pending))
+
+# Gives everyone who sends us messages their own TokenBucket, so one player flooding
+# a room can't crowd out everyone else. Buckets that have filled up again are thrown
+# away now and then, so players who have gone quiet don't cost anything.
+class FloodControl(object):
+    ALLOW = 0
+    THROTTLE = 1 # The first message over the limit, whoever sent it should be told to slow down.
+    DROP = 2
+
+    def __init__(self, rate, burst, clock=time.time, prune_interval=1000):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.prune_interval = prune_interval
+        self.buckets = {} # sender -> TokenBucket
+        self.throttled = set() # Senders who have been told to slow down since their last allowed message.
+        self.checks = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    # Returns ALLOW, THROTTLE or DROP for a message from sender.
+    def check(self, sender):
+        with self.lock:
+            self.checks += 1
+            if self.checks % self.prune_interval == 0:
+                self._prune()
+            bucket = self.buckets.get(sender)
+            if bucket is None:
+                bucket = self.buckets[sender] = TokenBucket(self.rate, self.burst, self.clock)
+            if bucket.take():
+                self.throttled.discard(sender)
+                return FloodControl.ALLOW
+            self.dropped += 1
+            if sender in self.throttled:
+                return FloodControl.DROP
+            self.throttled.add(sender)
+            return FloodControl.THROTTLE
+
+    def _prune(self):
+        now = self.clock()
+        for sender, bucket in list(self.buckets.items()):
+            if bucket.tokens + (now - bucket.last_refill) * bucket.rate >= bucket.capacity:
+                del self.buckets[sender]
+                self.throttled.discard(sender)
@@ -0,0 +1,99 @@
+import marshal
+import os
+import struct
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+RECORD_LENGTH = struct.Struct('<I')
+
+# GameStore saves a game to disk as a snapshot of its whole state plus a journal of the
+# changes made since. Changes are collected during a tick and written as one journal record
+# when the tick ends. All writing happens on a background thread so the tick never waits for the disk.
+#
+# Both files are marshal data. The journal is a sequence of records, each a uint32 length followed
+# by a marshalled (tick, [event, ...]) tuple. Writing a snapshot empties the journal, since
+# everything in it is now part of the snapshot.
+class GameStore(object):
+    def __init__(self, path):
+        self.snapshot_path = path + '.snapshot'
+        self.journal_path = path + '.journal'
+        self.events = [] # Events recorded this tick.
+        self.queue = Queue()
+        self.thread = None
+
+    # Returns (snapshot, [(tick, [event, ...]), ...]). snapshot is None if there isn't one yet.
+    # Call this before anything is recorded.
+    def load(self):
+        snapshot = None
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'rb') as snapshot_file:
+                snapshot = marshal.load(snapshot_file)
+        records = []
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as journal_file:
+                data = journal_file.read()
+            position = 0
+            while position + RECORD_LENGTH.size <= len(data):
+                length = RECORD_LENGTH.unpack_from(data, position)[0]
+                start = position + RECORD_LENGTH.size
+                if start + length > len(data):
+                    # The last record was only partly written, the bot must have stopped while writing it.
+                    break
+                records.append(marshal.loads(data[start:start+length]))
+                position = start + length
+        return snapshot, records
+
+    def start(self):
+        self.thread = threading.Thread(target=self.write_loop, name='GameStore ' + self.journal_path)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # event is a tuple of numbers and strings, the first item says what kind of event it is.
+    def record(self, event):
+        self.events.append(event)
+
+    # Sends this tick's events to be written.
+    def flush(self, tick):
+        if self.events:
+            self.queue.put(('journal', (tick, self.events)))
+            self.events = []
+
+    # Writes a snapshot. Any events recorded before it must already have been flushed.
+    def snapshot(self, state):
+        self.queue.put(('snapshot', state))
+
+    # Waits for everything to be written, and stops the writing thread.
+    def close(self):
+        self.queue.put(None)
+        if self.thread:
+            self.thread.join()
+
+    def write_loop(self):
+        journal_file = open(self.journal_path, 'ab')
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            kind, data = item
+            if kind == 'journal':
+                record = marshal.dumps(data)
+                journal_file.write(RECORD_LENGTH.pack(len(record)) + record)
+                # Write any other records that are waiting before flushing the file:
+                if self.queue.empty():
+                    journal_file.flush()
+            else:
+                # Write the snapshot next to the old one and swap it in, so there's always a whole snapshot on disk.
+                temporary_path = self.snapshot_path + '.new'
+                with open(temporary_path, 'wb') as snapshot_file:
+                    marshal.dump(data, snapshot_file)
+                    snapshot_file.flush()
+                    os.fsync(snapshot_file.fileno())
+                if os.name == 'nt' and os.path.exists(self.snapshot_path):
+                    os.remove(self.snapshot_path)
+                os.rename(temporary_path, self.snapshot_path)
+                journal_file.close()
+                journal_file = open(self.journal_path, 'wb')
+        journal_file.close()
@@ -0,0 +1,55 @@
+import heapq
+
+# An event waiting in the Scheduler. Keep hold of it if you might want to cancel it.
+class ScheduledEvent(object):
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick, callback, args):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+# Scheduler runs callbacks when global_ticks reaches the tick they were scheduled for.
+# It's a heap ordered by tick, so a tick only costs as much as the events that are due in it,
+# no matter how many actions and entities are waiting.
+class Scheduler(object):
+    def __init__(self):
+        self.events = [] # heap of (tick, sequence, ScheduledEvent)
+        self.sequence = 0 # Keeps events scheduled for the same tick in the order they were added.
+        self.cancelled_count = 0
+
+    def schedule(self, tick, callback, *args):
+        event = ScheduledEvent(tick, callback, args)
+        heapq.heappush(self.events, (tick, self.sequence, event))
+        self.sequence += 1
+        return event
+
+    # Cancelled events are left in the heap and skipped when they come up,
+    # the heap is rebuilt if they start to make up most of it.
+    def cancel(self, event):
+        if event.cancelled:
+            return
+        event.cancelled = True
+        self.cancelled_count += 1
+        if self.cancelled_count > 64 and self.cancelled_count * 2 > len(self.events):
+            # In place, as run_due may be part way through the heap when a callback cancels something.
+            self.events[:] = [entry for entry in self.events if not entry[2].cancelled]
+            heapq.heapify(self.events)
+            self.cancelled_count = 0
+
+    # Runs every event due at or before the given tick. Events scheduled by callbacks
+    # for the same tick are also run.
+    def run_due(self, tick):
+        events = self.events
+        while events and events[0][0] <= tick:
+            event = heapq.heappop(events)[2]
+            if event.cancelled:
+                self.cancelled_count -= 1
+                continue
+            # Mark it so cancelling an event that has already run does nothing:
+            event.cancelled = True
+            event.callback(*event.args)
+
+    def __len__(self):
+        return len(self.events) - self.cancelled_count
@@ -0,0 +1,125 @@
+import json
+import logging
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# Counts how many times fell in each power-of-two number of microseconds, so adding one is
+# cheap and it never grows. Percentiles are the top of the bucket they fall in.
+class Histogram(object):
+    __slots__ = ('counts', 'count', 'total', 'maximum')
+    BUCKETS = 32
+
+    def __init__(self):
+        self.counts = [0] * Histogram.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def add(self, seconds):
+        bucket = int(seconds * 1000000).bit_length()
+        self.counts[min(bucket, Histogram.BUCKETS-1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.maximum:
+            self.maximum = seconds
+
+    def percentile(self, fraction):
+        remaining = fraction * self.count
+        for bucket, count in enumerate(self.counts):
+            remaining -= count
+            if remaining <= 0 and count:
+                return min((1 << bucket) / 1000000.0, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(0.5) * 1000,
+            'p99_ms': self.percentile(0.99) * 1000,
+            'max_ms': self.maximum * 1000,
+        }
+
+# Timings for the busy parts of the bot: each phase of a tick, each command, and how much
+# is said to the rooms. It's off until enabled, and everything that records into it checks
+# enabled first, so it costs next to nothing when it's off.
+class Stats(object):
+    def __init__(self, tick_seconds=0.1, log_interval=60, clock=timer):
+        self.tick_seconds = tick_seconds
+        self.log_interval = log_interval
+        self.clock = clock
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.started = self.clock()
+        self.last_log = self.started
+        self.phases = {} # phase name -> Histogram
+        self.commands = {} # command name -> Histogram
+        self.ticks = 0
+        self.overruns = 0
+        self.lines = 0 # Lines the games said.
+        self.messages_sent = 0 # Messages those lines were sent to the rooms in.
+
+    def enable(self):
+        if not self.enabled:
+            self.reset()
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def add_phase(self, name, seconds):
+        histogram = self.phases.get(name)
+        if histogram is None:
+            histogram = self.phases[name] = Histogram()
+        histogram.add(seconds)
+
+    # A whole tick of the bot. It overran if it took longer than the time between ticks.
+    def add_tick(self, seconds):
+        self.ticks += 1
+        if seconds > self.tick_seconds:
+            self.overruns += 1
+        self.add_phase('tick', seconds)
+
+    def add_command(self, name, seconds):
+        histogram = self.commands.get(name)
+        if histogram is None:
+            histogram = self.commands[name] = Histogram()
+        histogram.add(seconds)
+
+    def report(self):
+        elapsed = max(self.clock() - self.started, 0.001)
+        return {
+            'seconds': elapsed,
+            'ticks': self.ticks,
+            'tick_overruns': self.overruns,
+            'phases': dict((name, histogram.summary()) for name, histogram in self.phases.items()),
+            'commands': dict((name, histogram.summary()) for name, histogram in self.commands.items()),
+            'lines_per_second': self.lines / elapsed,
+            'messages_per_second': self.messages_sent / elapsed,
+        }
+
+    # The report as a few lines of chat.
+    def report_text(self):
+        report = self.report()
+        lines = ['%d ticks in %.0fs, %d overran. %.2f lines and %.2f messages said a second.' % (
+            report['ticks'], report['seconds'], report['tick_overruns'],
+            report['lines_per_second'], report['messages_per_second'])]
+        for kind in ('phases', 'commands'):
+            for name, summary in sorted(report[kind].items()):
+                lines.append('%s: %d, mean %.2fms, p50 %.2fms, p99 %.2fms, max %.2fms' % (
+                    name, summary['count'], summary['mean_ms'], summary['p50_ms'], summary['p99_ms'], summary['max_ms']))
+        return '\n'.join(lines)
+
+    # Logs the report as one line of json every log_interval seconds. extra is called for
+    # a dict of anything else to put in the line, only when it's due.
+    def log_if_due(self, extra=None):
+        now = self.clock()
+        if now - self.last_log >= self.log_interval:
+            self.last_log = now
+            report = self.report()
+            if extra:
+                report.update(extra())
+            logging.info('stats ' + json.dumps(report, sort_keys=True))
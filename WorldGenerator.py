@@ -0,0 +1,107 @@
+# Builds large random worlds for testing, written straight to the binary world format.
+#
+#   python WorldGenerator.py <path> <room count> [seed]
+#
+# The same seed always gives the same world. Rooms are laid out on a square grid, numbered a row
+# at a time from the south-west corner. Each room is joined to one of the rooms before it to the
+# west, south-west, south or south-east, which makes a tree, so every room can reach every other.
+# Some of the other rooms it could join get joined too, so there's more than one way around.
+#
+# Since a room only joins rooms in its own row or the one before, only two rows of the world are
+# kept while generating. Descriptions go to a temporary file until the adjacency is written, so
+# even a world of millions of rooms only needs a few arrays in memory.
+from __future__ import print_function
+import math
+import os
+import random
+import shutil
+import sys
+from array import array
+from Map import Direction, NO_ROOM, WORLD_MAGIC, WORLD_HEADER
+
+ADJECTIVES = ['dusty', 'grassy', 'misty', 'rocky', 'muddy', 'quiet', 'windswept', 'scorched', 'frozen', 'overgrown']
+PLACES = ['path', 'clearing', 'valley', 'hillside', 'cave', 'riverbank', 'crater', 'field', 'ravine', 'plateau']
+FEATURES = [
+    '',
+    ' A broken robot lies rusting in the grass.',
+    ' Smoke rises somewhere in the distance.',
+    ' The ground is covered in huge footprints.',
+    ' An old sign has fallen over, you can\'t read it.',
+    ' Birds scatter as you arrive.',
+]
+
+# Each new room has this chance of joining each neighbour it isn't already joined to.
+LOOP_CHANCE = 0.15
+
+def describe_room(rng):
+    return 'a ' + rng.choice(ADJECTIVES) + ' ' + rng.choice(PLACES) + '.' + rng.choice(FEATURES)
+
+def write_slots(world_file, slots):
+    if sys.byteorder == 'big':
+        slots = array('i', slots)
+        slots.byteswap()
+    slots.tofile(world_file)
+
+def generate_world(path, room_count, seed=0, loop_chance=LOOP_CHANCE):
+    rng = random.Random(seed)
+    width = max(1, int(math.ceil(math.sqrt(room_count))))
+    row_slots = width * Direction.COUNT
+    previous = None # Adjacency of the row before this one.
+    current = array('i', [NO_ROOM]) * row_slots
+    offsets = array('I', [0])
+    text_path = path + '.text'
+
+    with open(path, 'wb') as world_file:
+        with open(text_path, 'w+b') as text_file:
+            world_file.write(WORLD_HEADER.pack(WORLD_MAGIC, room_count, 0))
+            for room_id in range(room_count):
+                column = room_id % width
+                if column == 0 and room_id:
+                    # The row before last can't get any more connections now.
+                    if previous is not None:
+                        write_slots(world_file, previous)
+                    previous, current = current, array('i', [NO_ROOM]) * row_slots
+
+                neighbours = [] # (direction, room id)
+                if column > 0:
+                    neighbours.append((Direction.WEST, room_id - 1))
+                if previous is not None:
+                    neighbours.append((Direction.SOUTH, room_id - width))
+                    if column > 0:
+                        neighbours.append((Direction.SOUTHWEST, room_id - width - 1))
+                    if column < width - 1:
+                        neighbours.append((Direction.SOUTHEAST, room_id - width + 1))
+                if neighbours:
+                    tree_neighbour = rng.randrange(len(neighbours))
+                    for index, (direction, neighbour) in enumerate(neighbours):
+                        if index == tree_neighbour or rng.random() < loop_chance:
+                            neighbour_row = current if neighbour // width == room_id // width else previous
+                            current[column*Direction.COUNT + direction] = neighbour
+                            # The neighbour gets the way back, the opposite direction:
+                            neighbour_row[(neighbour % width)*Direction.COUNT + (direction + 4) % 8] = room_id
+
+                description = describe_room(rng).encode('utf-8')
+                text_file.write(description)
+                offsets.append(offsets[-1] + len(description))
+
+            if previous is not None:
+                write_slots(world_file, previous)
+            if room_count:
+                rooms_in_last_row = room_count - (room_count - 1) // width * width
+                write_slots(world_file, current[:rooms_in_last_row*Direction.COUNT])
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            offsets.tofile(world_file)
+            text_file.seek(0)
+            shutil.copyfileobj(text_file, world_file)
+    os.remove(text_path)
+
+# Yields (room id, enemy type name) for density enemies a room on average, spread at random over the world.
+def place_enemies(room_count, density, type_names, seed=0):
+    rng = random.Random(seed)
+    type_names = sorted(type_names)
+    for number in range(int(room_count * density)):
+        yield rng.randrange(room_count), rng.choice(type_names)
+
+if __name__ == '__main__':
+    generate_world(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 0)
@@ -0,0 +1,192 @@
+# Simulates hundreds of chat players talking to the AdventureMech plugin at once, to find out
+# how many it takes before the 0.1 second tick starts to slip.
+#
+#   python benchmarks/load.py [--players 50,100,200,400] [--rooms 1] [--rate 0.2] [--seconds 20]
+#                             [--mix look=3,n=1,s=1,"attack rat"=2] [--message-rate 1] [--output results.json]
+#
+# Fake players send messages to callback_message in real time, each at --rate messages a second
+# on average, while the plugin's own game loop ticks the games on its thread.
+# Each player joins with their first message, after that they say something picked from the mix.
+#
+# Reports, for each player count:
+#   throughput     commands handled a second
+#   latency        seconds from a player speaking to the next message the bot sends to their room.
+#                  Commands that get no answer count as answered by whatever the room hears next.
+#   tick overruns  ticks that finished after the next tick was due
+#   throttled      commands ignored for going over a player's rate limit, or because the loop was full
+#   tick           how long each tick took, from the plugin's timings
+# Needs errbot and xmpp to be importable, as AdventureMech does, but no chat server.
+from __future__ import print_function
+import argparse
+import heapq
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from AdventureMech import AdventureMech
+from Game import Game
+from simulation import summarise, current_commit, number_list
+
+timer = getattr(time, 'perf_counter', time.time)
+
+DEFAULT_MIX = 'look=3,n=1,s=1,e=1,w=1,attack rat=2,look at rat=1'
+
+class FakeJID(object):
+    def __init__(self, room, name):
+        self.room = room
+        self.name = name
+
+    def getStripped(self):
+        return self.room
+
+    def getResource(self):
+        return self.name
+
+class FakeMessage(object):
+    def __init__(self, room, name, body):
+        self.sender = FakeJID(room, name)
+        self.body = body
+
+    def getType(self):
+        return 'groupchat'
+
+    def getFrom(self):
+        return self.sender
+
+    def getBody(self):
+        return self.body
+
+# The plugin sending into a log of when each room was answered rather than to a chat server.
+# Messages arrive on the load generator's thread and are answered on the game loop's, as they would be in errbot.
+class LoadTestMech(AdventureMech):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiting = defaultdict(list) # room -> times of commands not yet answered
+        self.latencies = []
+        self.messages_sent = 0
+        AdventureMech.__init__(self)
+        self.timings.enable()
+
+    def save_path(self, room):
+        return None
+
+    def send(self, jid, text, message_type=None):
+        now = timer()
+        with self.lock:
+            self.messages_sent += 1
+            waiting = self.waiting[jid.getStripped()]
+            for sent_time in waiting:
+                self.latencies.append(now - sent_time)
+            del waiting[:]
+
+    def receive(self, room, name, body, sent_time):
+        with self.lock:
+            self.waiting[room].append(sent_time)
+        self.callback_message(None, FakeMessage(room, name, body))
+
+def parse_mix(text):
+    mix = []
+    for item in text.split(','):
+        command, weight = item.rsplit('=', 1)
+        mix.extend([command.strip()] * int(weight))
+    return mix
+
+def run(players, rooms, rate, seconds, mix, seed=1):
+    random.seed(seed)
+    plugin = LoadTestMech()
+    room_names = ['loadtest%d@conf.example.com' % number for number in range(rooms)]
+    joined = [False] * players
+
+    start = timer()
+    end = start + seconds
+    arrivals = [(start + random.expovariate(rate), player) for player in range(players)]
+    heapq.heapify(arrivals)
+    commands = 0
+
+    while arrivals[0][0] < end:
+        sent_time, player = heapq.heappop(arrivals)
+        delay = sent_time - timer()
+        if delay > 0:
+            time.sleep(delay)
+        if joined[player]:
+            body = random.choice(mix)
+        else:
+            body = 'join'
+            joined[player] = True
+        plugin.receive(room_names[player % rooms], 'player' + str(player), body, sent_time)
+        commands += 1
+        heapq.heappush(arrivals, (sent_time + random.expovariate(rate), player))
+
+    delay = end - timer()
+    if delay > 0:
+        time.sleep(delay)
+    plugin.loop.stop()
+    elapsed = timer() - start
+    for game in plugin.games.values():
+        game.close()
+    timings = plugin.timings.report()
+    return {
+        'players': players,
+        'rooms': rooms,
+        'rate': rate,
+        'seconds': elapsed,
+        'commands': commands,
+        'throughput': commands / elapsed,
+        'messages_sent': plugin.messages_sent,
+        'unanswered': sum(len(waiting) for waiting in plugin.waiting.values()),
+        'latency': summarise(plugin.latencies),
+        'ticks': plugin.loop.ticks,
+        'tick_overruns': plugin.loop.late_ticks,
+        'dropped_ticks': plugin.loop.dropped_ticks,
+        'throttled': plugin.flood_control.dropped + plugin.loop.refused,
+        'tick': timings['phases'].get('tick'),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate many chat players talking to AdventureMech.')
+    parser.add_argument('--players', type=number_list, default=[50, 100, 200, 400])
+    parser.add_argument('--rooms', type=int, default=1, help='game rooms the players are spread over')
+    parser.add_argument('--rate', type=float, default=0.2, help='messages a second from each player')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='comma separated command=weight pairs')
+    parser.add_argument('--message-rate', type=float, help="override the games' outgoing message rate limit")
+    parser.add_argument('--output', help='file to write the json results to, instead of printing them')
+    options = parser.parse_args()
+
+    if options.message_rate:
+        Game.MESSAGE_RATE = options.message_rate
+        Game.MESSAGE_BURST = max(Game.MESSAGE_BURST, int(options.message_rate))
+    mix = parse_mix(options.mix)
+
+    results = []
+    for players in options.players:
+        result = run(players, options.rooms, options.rate, options.seconds, mix)
+        results.append(result)
+        latency = result['latency'] or {'p50_ms': 0, 'p99_ms': 0}
+        print('players %5d  %6.1f commands/s  latency p50 %.0fms p99 %.0fms  %d/%d ticks overran' % (
+            players, result['throughput'], latency['p50_ms'], latency['p99_ms'],
+            result['tick_overruns'], result['ticks']), file=sys.stderr)
+
+    report = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'time': time.time(),
+        'mix': options.mix,
+        'message_rate': Game.MESSAGE_RATE,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Measures how many bytes each room, enemy and player takes up, at several world sizes.
+#
+#   python benchmarks/memory.py [count ...]
+#
+# Sizes are found by walking everything the objects refer to and adding up sys.getsizeof,
+# counting each object once. Things every object shares (enemy types, classes, functions)
+# aren't counted, so the numbers are the cost of one more room, enemy or player.
+from __future__ import print_function
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from Map import Map
+from Game import Game, Player, PlayerRegistry, SimpleEnemy, EntityIndex, load_enemy_types
+from EnemyStore import EnemyStore
+
+DEFAULT_COUNTS = [10000, 100000, 1000000]
+
+SHARED_TYPES = (type, types.FunctionType, types.MethodType, types.BuiltinFunctionType, types.ModuleType)
+
+def deep_size(root, shared=()):
+    seen = set(id(item) for item in shared)
+    size = 0
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, SHARED_TYPES):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        if hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+        for cls in type(item).__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                if hasattr(item, name):
+                    stack.append(getattr(item, name))
+    return size
+
+def room_bytes(count):
+    world_map = Map(count)
+    for room_id in range(1, count):
+        world_map.make_connection(room_id - 1, room_id, 0)
+    return deep_size(world_map) / float(count)
+
+def enemy_bytes(count, enemy_types):
+    store = EnemyStore()
+    index = EntityIndex()
+    for number in range(count):
+        enemy = SimpleEnemy(enemy_types['rat'], number)
+        enemy.id = number
+        store.add(enemy)
+        index.add(enemy)
+    return deep_size((store, index), list(enemy_types.values())) / float(count)
+
+def player_bytes(count):
+    registry = PlayerRegistry()
+    for number in range(count):
+        registry.join(Player('player' + str(number)), 0)
+    return deep_size(registry) / float(count)
+
+def main(counts):
+    enemy_types = load_enemy_types(Game.ENEMY_FILE)
+    print('count\troom\tenemy\tplayer')
+    for count in counts:
+        print('%d\t%.1f\t%.1f\t%.1f' % (count, room_bytes(count), enemy_bytes(count, enemy_types), player_bytes(count)))
+
+if __name__ == '__main__':
+    main([int(count) for count in sys.argv[1:]] or DEFAULT_COUNTS)
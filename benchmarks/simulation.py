@@ -0,0 +1,151 @@
+# Benchmarks tick and command latency and memory use as the world, the number of enemies
+# and the number of players grow, using a HeadlessGame so no chat server is needed.
+#
+#   python benchmarks/simulation.py [--rooms 1000,10000] [--entities 100,1000] [--players 1,10]
+#                                   [--ticks 600] [--output results.json]
+#
+# Each dimension is grown on its own with the others at their base values. Worlds are made by
+# WorldGenerator, with the enemies spread over them at random, always from the same seed.
+# Results are written as json, along with the commit they were measured on, so runs can be
+# compared across commits.
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from Game import Game, SimpleEnemy, load_enemy_types
+from Headless import HeadlessGame
+from WorldGenerator import generate_world, place_enemies
+from memory import deep_size
+
+timer = getattr(time, 'perf_counter', time.time)
+
+BASE_ROOMS = 10000
+BASE_ENTITIES = 1000
+BASE_PLAYERS = 10
+COMMANDS = ['look', 'n', 's', 'look at rat', 'attack rat', 'e', 'w']
+
+# Returns the path of a generated world with the given number of rooms, making it the first time.
+def world_file(directory, rooms, seed):
+    path = os.path.join(directory, '%d-%d.world' % (rooms, seed))
+    if not os.path.exists(path):
+        generate_world(path, rooms, seed)
+    return path
+
+# A game with enemies spread over the world, and one rat that won't die in the starting room for the players to fight.
+def build_game(directory, rooms, entities, players, seed=1):
+    enemy_types = load_enemy_types(Game.ENEMY_FILE)
+    enemies = place_enemies(rooms, entities / float(rooms), enemy_types.keys(), seed)
+    headless = HeadlessGame(world_file(directory, rooms, seed), seed=seed, enemies=enemies)
+    game = headless.game
+    target = SimpleEnemy(game.enemy_types['rat'], game.mechs[0].position)
+    target.health = 10**9
+    game.add_entity(target)
+    for number in range(players):
+        headless.say('player' + str(number), 'join')
+    return headless
+
+def summarise(samples):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    def percentile(fraction):
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000
+    return {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+        'p50_ms': percentile(0.5),
+        'p99_ms': percentile(0.99),
+        'max_ms': samples[-1] * 1000,
+    }
+
+def run(directory, rooms, entities, players, ticks):
+    headless = build_game(directory, rooms, entities, players)
+    game = headless.game
+
+    # Everyone fights the rat while the ticks are timed.
+    for number in range(players):
+        headless.say('player' + str(number), 'attack rat')
+    tick_times = []
+    for tick in range(ticks):
+        start = timer()
+        headless.tick()
+        tick_times.append(timer() - start)
+
+    command_times = []
+    for number in range(max(100, players)):
+        text = COMMANDS[number % len(COMMANDS)]
+        start = timer()
+        headless.say('player' + str(number % max(1, players)), text)
+        command_times.append(timer() - start)
+        headless.transport.take()
+
+    return {
+        'rooms': rooms,
+        'entities': entities,
+        'players': players,
+        'tick': summarise(tick_times),
+        'command': summarise(command_times),
+        'memory_bytes': deep_size(game, list(game.enemy_types.values())),
+    }
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def number_list(text):
+    return [int(number) for number in text.split(',') if number]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a headless game.')
+    parser.add_argument('--rooms', type=number_list, default=[1000, 10000, 100000])
+    parser.add_argument('--entities', type=number_list, default=[100, 1000, 10000])
+    parser.add_argument('--players', type=number_list, default=[1, 10, 100])
+    parser.add_argument('--ticks', type=int, default=600)
+    parser.add_argument('--output', help='file to write the json results to, instead of printing them')
+    options = parser.parse_args()
+
+    cases = []
+    for rooms in options.rooms:
+        cases.append((rooms, BASE_ENTITIES, BASE_PLAYERS))
+    for entities in options.entities:
+        cases.append((BASE_ROOMS, entities, BASE_PLAYERS))
+    for players in options.players:
+        cases.append((BASE_ROOMS, BASE_ENTITIES, players))
+
+    results = []
+    directory = tempfile.mkdtemp()
+    for rooms, entities, players in cases:
+        result = run(directory, rooms, entities, players, options.ticks)
+        results.append(result)
+        print('rooms %7d entities %7d players %5d  tick p99 %.3fms  command p99 %.3fms  memory %dKB' % (
+            rooms, entities, players, result['tick']['p99_ms'], result['command']['p99_ms'],
+            result['memory_bytes'] // 1024), file=sys.stderr)
+    shutil.rmtree(directory)
+
+    report = {
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'time': time.time(),
+        'ticks': options.ticks,
+        'results': results,
+    }
+    if options.output:
+        with open(options.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+    main()